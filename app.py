@@ -2,24 +2,28 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import json
 import os
 import re
-import zipfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from typing import TYPE_CHECKING
 
 from dotenv import load_dotenv
-from langchain_core.agents import AgentFinish
-from langchain_groq import ChatGroq
 
-load_dotenv()
+from stream_json import ObjectStream, OffSchema, extract_json_object
 
-from graph import app
-from renderer import render_docx
+load_dotenv()
 
+# LangChain/LangGraph, the clients and the compiled graph load on first use, not at import:
+# --help, --dry-run and worker start-up stay fast (see dev-test/check_import_time.py)
+if TYPE_CHECKING:
+    from checkpoint import RunCheckpoint
+    from prefetch import Prefetcher
 
-def _list_embedded_media(docx_path: str) -> list[str]:
-    with zipfile.ZipFile(docx_path) as z:
-        return [n for n in z.namelist() if n.startswith("word/media/")]
 
 def _count_words(doc_spec: dict) -> int:
     def wc(s: str) -> int:
@@ -35,10 +39,6 @@ def _count_words(doc_spec: dict) -> int:
             total += wc(img.get("caption", ""))
     return total
 
-def _extract_json_object(text: str) -> str:
-    m = re.search(r"(\{[\s\S]*\})", text)
-    return (m.group(1) if m else text).strip()
-
 def _is_valid_doc_spec(d: dict) -> bool:
     return (
         isinstance(d, dict)
@@ -48,12 +48,9 @@ def _is_valid_doc_spec(d: dict) -> bool:
         and isinstance(d.get("references", []), list)
     )
 
-def _expand_to_target(doc_spec: dict, target_words: int, assets_brief: list[dict]) -> dict:
+def _expand_prompt(doc_spec: dict, target_words: int, assets_brief: list[dict]) -> str:
     # LLM word counts aren’t exact; use range. :contentReference[oaicite:1]{index=1}
-    model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
-    llm = ChatGroq(model=model, temperature=0, max_tokens=2000, timeout=60, max_retries=0)
-
-    prompt = f"""
+    return f"""
 You must return ONLY valid JSON (no markdown). Expand the blog to be ~{target_words} words (±10%).
 Keep the same schema.
 
@@ -75,25 +72,307 @@ Rules:
 Here is the current JSON to expand:
 {json.dumps(doc_spec, ensure_ascii=False)}
 """
-    raw = _extract_json_object(str(llm.invoke(prompt).content))
-    d = json.loads(raw)
-    if not _is_valid_doc_spec(d):
-        return doc_spec
-    return d
-
-
-def run(topic: str, target_words: int) -> str:
-    result = app.invoke(
-        {
-            "topic": topic,
-            "target_words": target_words,     # NEW
-            "agent_outcome": None,
-            "intermediate_steps": [],
-            "assets": [],
-        },
-        config={"recursion_limit": 30},
+
+
+def _parse_expanded(text: str) -> dict | None:
+    d = json.loads(extract_json_object(text) or text)
+    return d if _is_valid_doc_spec(d) else None
+
+
+def _section_events(on_event, source: str):
+    if on_event is None:
+        return None
+    return lambda i, sec: _emit(on_event, "section", source=source, index=i, **_section_info(sec))
+
+
+def _section_info(sec: dict) -> dict:
+    info = {"paragraphs": len(sec.get("paragraphs") or [])}
+    if "heading" in sec:
+        info["heading"] = sec["heading"]
+    if "section" in sec:
+        info["section"] = sec["section"]
+    return info
+
+
+def _expand_to_target(doc_spec: dict, target_words: int, assets_brief: list[dict], on_event=None) -> dict:
+    from llm import stage_models
+    from nodes import _doc_spec_stream
+
+    # Streamed: the rewrite is dropped at the first off-schema token, finished sections are reported as they close.
+    # A rewrite that does not parse is tried once more on the large model if the stage is routed to another one.
+    prompt = _expand_prompt(doc_spec, target_words, assets_brief)
+    for model in stage_models("expand"):
+        parser = _doc_spec_stream(_section_events(on_event, "expand"))
+        try:
+            expanded = _parse_expanded(model.stream(prompt, parser.feed))
+        except ValueError:  # OffSchema or a truncated reply
+            continue
+        if expanded is not None:
+            return expanded
+    return doc_spec
+
+
+async def _aexpand_to_target(doc_spec: dict, target_words: int, assets_brief: list[dict], on_event=None) -> dict:
+    from llm import stage_models
+    from nodes import _doc_spec_stream
+
+    prompt = _expand_prompt(doc_spec, target_words, assets_brief)
+    for model in stage_models("expand"):
+        parser = _doc_spec_stream(_section_events(on_event, "expand"))
+        try:
+            expanded = _parse_expanded(await model.astream(prompt, parser.feed))
+        except ValueError:
+            continue
+        if expanded is not None:
+            return expanded
+    return doc_spec
+
+
+def _section_gaps(doc_spec: dict, target_words: int) -> list[dict]:
+    """Per-section word shortfall against an even share of the target."""
+    sections = doc_spec.get("sections", []) or []
+    overhead = _count_words({"title": doc_spec.get("title", ""), "subtitle": doc_spec.get("subtitle", "")})
+    share = max(0, target_words - overhead) // max(1, len(sections))
+    gaps = []
+    for i, sec in enumerate(sections):
+        have = _count_words({"sections": [sec]})
+        if have < share:
+            gaps.append({"section": i, "heading": sec.get("heading", ""), "have_words": have, "add_words": share - have})
+    return gaps
+
+
+def _top_up_prompt(doc_spec: dict, gaps: list[dict]) -> str:
+    # Only headings and paragraph openings go out, never the full text
+    digest = [
+        {"section": i, "heading": s.get("heading", ""), "covers": [" ".join(str(p).split()[:12]) for p in s.get("paragraphs", [])]}
+        for i, s in enumerate(doc_spec.get("sections", []))
+    ]
+    return f"""
+Return ONLY valid JSON (no markdown). Add NEW paragraphs to fill the word gaps of a blog; do not rewrite existing text.
+
+Schema:
+{{"additions":[{{"section":0,"paragraphs":["string"]}}],"new_sections":[{{"heading":"string","paragraphs":["string"]}}]}}
+
+Blog: {doc_spec.get("title", "")}
+Existing sections (first words of each paragraph, do not repeat them):
+{json.dumps(digest, ensure_ascii=False)}
+
+Gaps (write ~add_words new words for each, paragraphs of ~60–110 words, concrete detail not fluff):
+{json.dumps(gaps, ensure_ascii=False)}
+
+Use "new_sections" only if a subtopic is clearly missing.
+"""
+
+
+def _is_valid_addition(add) -> bool:
+    return isinstance(add, dict) and isinstance(add.get("section"), int) and isinstance(add.get("paragraphs"), list)
+
+
+def _top_up_stream(on_event) -> ObjectStream:
+    return ObjectStream(
+        {"additions": "[", "new_sections": "["}, "additions", _is_valid_addition, _section_events(on_event, "top_up")
     )
 
+
+def _merge_top_up(doc_spec: dict, text: str) -> dict:
+    try:
+        d = json.loads(extract_json_object(text) or text)
+    except Exception:
+        return doc_spec  # keep what we have; the caller may try again
+    if not isinstance(d, dict):
+        return doc_spec
+    merged = json.loads(json.dumps(doc_spec))
+    sections = merged["sections"]
+    for add in _list(d.get("additions")):
+        idx = add.get("section") if _is_valid_addition(add) else None
+        pars = _paragraphs(add)
+        if isinstance(idx, int) and 0 <= idx < len(sections) and pars:
+            sections[idx].setdefault("paragraphs", []).extend(pars)
+    for sec in _list(d.get("new_sections")):
+        pars = _paragraphs(sec)
+        if str(sec.get("heading", "")).strip() and pars:
+            sections.append({"heading": str(sec["heading"]), "paragraphs": pars, "images": []})
+    return merged if _is_valid_doc_spec(merged) else doc_spec
+
+
+def _list(v) -> list:
+    return v if isinstance(v, list) else []
+
+
+def _paragraphs(item) -> list[str]:
+    # Only a list of strings; a bare string would otherwise be merged one character per paragraph
+    if not isinstance(item, dict) or not isinstance(item.get("paragraphs"), list):
+        return []
+    return [p for p in item["paragraphs"] if isinstance(p, str) and p.strip()]
+
+
+def _top_up_tokens(gaps: list[dict]) -> int:
+    return min(2000, int(sum(g["add_words"] for g in gaps) * 1.6) + 200)
+
+
+def _top_up(doc_spec: dict, target_words: int, assets_brief: list[dict], on_event=None) -> dict:
+    from llm import stage_models
+
+    gaps = _section_gaps(doc_spec, target_words)
+    if not gaps:
+        return doc_spec
+    # Like the rewrite: additions that do not parse are asked of the large model if the stage routes elsewhere
+    prompt = _top_up_prompt(doc_spec, gaps)
+    for model in stage_models("expand", _top_up_tokens(gaps)):
+        try:
+            merged = _merge_top_up(doc_spec, model.stream(prompt, _top_up_stream(on_event).feed))
+        except OffSchema:
+            continue
+        if merged is not doc_spec:
+            return merged
+    return doc_spec
+
+
+async def _atop_up(doc_spec: dict, target_words: int, assets_brief: list[dict], on_event=None) -> dict:
+    from llm import stage_models
+
+    gaps = _section_gaps(doc_spec, target_words)
+    if not gaps:
+        return doc_spec
+    prompt = _top_up_prompt(doc_spec, gaps)
+    for model in stage_models("expand", _top_up_tokens(gaps)):
+        try:
+            merged = _merge_top_up(doc_spec, await model.astream(prompt, _top_up_stream(on_event).feed))
+        except OffSchema:
+            continue
+        if merged is not doc_spec:
+            return merged
+    return doc_spec
+
+
+def _initial_state(topic: str, target_words: int) -> dict:
+    return {
+        "topic": topic,
+        "target_words": target_words,     # NEW
+        "agent_outcome": None,
+        "intermediate_steps": [],
+        "step_count": 0,
+        "assets": [],
+    }
+
+
+def _graph_config(prefetcher: Prefetcher | None, run_id: str | None = None, on_event=None) -> dict:
+    configurable: dict = {}
+    if prefetcher is not None:
+        configurable["prefetcher"] = prefetcher
+    if run_id is not None:
+        configurable["thread_id"] = run_id
+    if on_event is not None:
+        configurable["on_event"] = on_event  # the final-answer call reports sections as they stream in
+    return {"recursion_limit": 30, "configurable": configurable}
+
+
+def _node_event(node: str, update: dict | None) -> dict:
+    from langchain_core.agents import AgentFinish
+
+    ev: dict = {"stage": "agent", "node": node}
+    update = update or {}
+    outcome = update.get("agent_outcome")
+    if isinstance(outcome, AgentFinish):
+        ev["final"] = True
+    elif isinstance(outcome, list):
+        ev["action"] = [a.tool for a in outcome]
+        ev["input"] = [str(a.tool_input)[:200] for a in outcome]
+    elif outcome is not None:
+        ev["action"] = outcome.tool
+        ev["input"] = str(outcome.tool_input)[:200]
+    if update.get("intermediate_steps"):
+        ev["steps"] = len(update["intermediate_steps"])
+    if update.get("assets"):
+        ev["assets"] = [a["asset_id"] for a in update["assets"]]
+    return ev
+
+
+def _drive(graph, inp: dict | None, config: dict, on_event) -> dict:
+    """graph.invoke(), or graph.stream() reporting every finished node when someone is listening."""
+    if on_event is None:
+        return graph.invoke(inp, config=config)
+    final: dict = {}
+    for kind, chunk in graph.stream(inp, config=config, stream_mode=["updates", "values"]):
+        if kind == "values":
+            final = chunk
+        else:
+            for node, update in chunk.items():
+                on_event(_node_event(node, update))
+    return final
+
+
+async def _adrive(graph, inp: dict | None, config: dict, on_event) -> dict:
+    if on_event is None:
+        return await graph.ainvoke(inp, config=config)
+    final: dict = {}
+    async for kind, chunk in graph.astream(inp, config=config, stream_mode=["updates", "values"]):
+        if kind == "values":
+            final = chunk
+        else:
+            for node, update in chunk.items():
+                on_event(_node_event(node, update))
+    return final
+
+
+def _invoke_agent(topic: str, target_words: int, config: dict, resume: bool, on_event=None) -> dict:
+    """Run the ReAct graph; with a thread_id it is checkpointed and resume picks up after the last node."""
+    from graph import app, checkpointed_app
+
+    run_id = config["configurable"].get("thread_id")
+    if run_id is None:
+        return _drive(app, _initial_state(topic, target_words), config, on_event)
+    graph = checkpointed_app()
+    if not resume:
+        graph.checkpointer.delete_thread(run_id)
+    snapshot = graph.get_state(config)
+    if snapshot.values and not snapshot.next:
+        return snapshot.values  # the agent already finished in an earlier attempt
+    return _drive(graph, None if snapshot.next else _initial_state(topic, target_words), config, on_event)
+
+
+async def _ainvoke_agent(topic: str, target_words: int, config: dict, resume: bool, on_event=None) -> dict:
+    from graph import acheckpointed_app, app
+
+    run_id = config["configurable"].get("thread_id")
+    if run_id is None:
+        return await _adrive(app, _initial_state(topic, target_words), config, on_event)
+    async with acheckpointed_app() as graph:
+        if not resume:
+            await graph.checkpointer.adelete_thread(run_id)
+        snapshot = await graph.aget_state(config)
+        if snapshot.values and not snapshot.next:
+            return snapshot.values
+        return await _adrive(graph, None if snapshot.next else _initial_state(topic, target_words), config, on_event)
+
+
+def _emit(on_event, stage: str, **info) -> None:
+    if on_event is not None:
+        on_event({"stage": stage, **info})
+
+
+def _run_checkpoint(run_id: str | None, resume: bool) -> RunCheckpoint | None:
+    if run_id is None:
+        return None
+    from checkpoint import RunCheckpoint
+
+    ckpt = RunCheckpoint(run_id)
+    if not resume:
+        ckpt.clear()
+    return ckpt
+
+
+def _stage(ckpt: RunCheckpoint | None, name: str, fn):
+    return ckpt.stage(name, fn) if ckpt is not None else fn()
+
+
+async def _astage(ckpt: RunCheckpoint | None, name: str, fn):
+    return await ckpt.astage(name, fn) if ckpt is not None else await fn()
+
+
+def _unpack_result(result: dict) -> tuple[dict, dict, list[dict]]:
+    from langchain_core.agents import AgentFinish
+
     final = result.get("agent_outcome")
     if not isinstance(final, AgentFinish):
         raise RuntimeError(f"Agent did not finish. outcome={type(final)}")
@@ -104,27 +383,332 @@ def run(topic: str, target_words: int) -> str:
     assets = result.get("assets", [])
     assets_by_id = {a["asset_id"]: a for a in assets}
     assets_brief = [{"asset_id": a["asset_id"], "source_url": a["source_url"]} for a in assets]
+    return doc_spec, assets_by_id, assets_brief
+
+
+def _is_short(doc_spec: dict, target_words: int) -> bool:
+    return _count_words(doc_spec) < int(target_words * 0.9)
+
+
+def _save(doc_spec: dict, assets_by_id: dict, out_dir: str) -> str:
+    import tools
+    from renderer import render_docx
+    from telemetry import span
+
+    out_path = os.path.join(out_dir, "blog.docx")
+    with span("render_docx") as rec:
+        media = render_docx(doc_spec, assets_by_id, out_path)
+        rec["images"] = len(media)
+        rec["bytes"] = os.path.getsize(out_path)
+    tools.ASSET_STORE.flush()
+    return out_path
+
+
+def _report(out_path: str | None = None) -> None:
+    """The CLI's summary. run()/arun() print nothing: they also serve batch jobs and the HTTP service."""
+    import zipfile
+
+    import tools
+    from docx import Document
+    from llm import llm_cache_stats, llm_latency_stats
+
+    if out_path:
+        print("Saved:", out_path)
+        print("Approx words:", sum(len(p.text.split()) for p in Document(out_path).paragraphs))
+        with zipfile.ZipFile(out_path) as z:
+            print("Embedded images:", [n for n in z.namelist() if n.startswith("word/media/")])
+    print("Asset cache:", tools.ASSET_STORE.stats())
+    print("LLM cache:", llm_cache_stats())
+    print("LLM latency:", llm_latency_stats())
+
+
+def run(
+    topic: str,
+    target_words: int,
+    out_dir: str = "output",
+    mode: str = "outline",
+    trace_path: str | None = None,
+    speculative: bool = False,
+    run_id: str | None = None,
+    resume: bool = False,
+    on_event: Callable[[dict], None] | None = None,
+) -> str:
+    """Generate one blog. With run_id every stage is checkpointed; resume=True continues that run.
 
-    # Bulletproof length enforcement (max 2 expansions)
-    for _ in range(2):
-        wc = _count_words(doc_spec)
-        if wc >= int(target_words * 0.9):
+    on_event, if given, is called with a small dict after every graph node and post-processing stage.
+    """
+    from longform import write_longform
+    from prefetch import Prefetcher
+    from telemetry import span, start_trace
+
+    trace = start_trace(topic)
+    ckpt = _run_checkpoint(run_id, resume)
+    # Speculative mode: bootstrap/follow-up searches and their images start now, overlapping the LLM turns
+    prefetcher = Prefetcher(topic) if speculative else None
+    try:
+        result = _invoke_agent(topic, target_words, _graph_config(prefetcher, run_id, on_event), resume, on_event)
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+    doc_spec, assets_by_id, assets_brief = _unpack_result(result)
+
+    # Outline mode: the agent's spec is the research draft; sections are written in parallel to budget
+    if mode == "outline" and _is_short(doc_spec, target_words):
+        doc_spec = _stage(ckpt, "longform", lambda: write_longform(topic, target_words, doc_spec, assets_brief))
+        _emit(on_event, "longform", words=_count_words(doc_spec))
+
+    # Bulletproof length enforcement (max 2 expansions); delta top-ups keep existing text
+    expand = _expand_to_target if mode == "expand" else _top_up
+    for i in range(2):
+        if not _is_short(doc_spec, target_words):
             break
-        doc_spec = _expand_to_target(doc_spec, target_words, assets_brief)
+        with span("expand", round=i + 1, mode=mode):
+            doc_spec = _stage(ckpt, f"expand{i + 1}", lambda d=doc_spec: expand(d, target_words, assets_brief, on_event))
+        _emit(on_event, "expand", round=i + 1, words=_count_words(doc_spec))
+
+    out_path = _stage(ckpt, "render", lambda: _save(doc_spec, assets_by_id, out_dir))
+    if not os.path.exists(out_path):
+        out_path = _save(doc_spec, assets_by_id, out_dir)
+    _emit(on_event, "render", path=out_path)
+    if trace_path:
+        trace.write(trace_path)
+    return out_path
+
+
+async def arun(
+    topic: str,
+    target_words: int,
+    out_dir: str = "output",
+    mode: str = "outline",
+    trace_path: str | None = None,
+    speculative: bool = False,
+    run_id: str | None = None,
+    resume: bool = False,
+    on_event: Callable[[dict], None] | None = None,
+) -> str:
+    """Async twin of run(): many jobs can share one event loop while waiting on I/O."""
+    from longform import awrite_longform
+    from prefetch import Prefetcher
+    from telemetry import span, start_trace
+
+    trace = start_trace(topic)
+    ckpt = _run_checkpoint(run_id, resume)
+    prefetcher = Prefetcher(topic) if speculative else None
+    try:
+        result = await _ainvoke_agent(topic, target_words, _graph_config(prefetcher, run_id, on_event), resume, on_event)
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+    doc_spec, assets_by_id, assets_brief = _unpack_result(result)
 
-    out_path = os.path.join("output", "blog.docx")
-    render_docx(doc_spec, assets_by_id, out_path)
+    if mode == "outline" and _is_short(doc_spec, target_words):
+        doc_spec = await _astage(ckpt, "longform", lambda: awrite_longform(topic, target_words, doc_spec, assets_brief))
+        _emit(on_event, "longform", words=_count_words(doc_spec))
 
-    print("Saved:", out_path)
-    print("Approx words:", _count_words(doc_spec))
-    print("Embedded images:", _list_embedded_media(out_path))
+    aexpand = _aexpand_to_target if mode == "expand" else _atop_up
+    for i in range(2):
+        if not _is_short(doc_spec, target_words):
+            break
+        with span("expand", round=i + 1, mode=mode):
+            doc_spec = await _astage(ckpt, f"expand{i + 1}", lambda d=doc_spec: aexpand(d, target_words, assets_brief, on_event))
+        _emit(on_event, "expand", round=i + 1, words=_count_words(doc_spec))
+
+    out_path = await _astage(ckpt, "render", lambda: asyncio.to_thread(_save, doc_spec, assets_by_id, out_dir))
+    if not os.path.exists(out_path):
+        out_path = await asyncio.to_thread(_save, doc_spec, assets_by_id, out_dir)
+    _emit(on_event, "render", path=out_path)
+    if trace_path:
+        trace.write(trace_path)
     return out_path
 
 
+def _load_jobs(path: str, default_words: int) -> list[dict]:
+    jobs = []
+    seen: dict[str, int] = {}  # job dir name -> line that claimed it
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            d = json.loads(line)
+            topic = d.get("topic") or d.get("title")
+            if not topic:
+                raise ValueError(f"{path}:{i}: job needs a 'topic' (or 'title')")
+            raw_id = str(d.get("id") or d.get("request_id") or f"job-{i:04d}")
+            job_id = re.sub(r"[^\w.-]+", "_", raw_id)
+            if not job_id.strip("."):
+                raise ValueError(f"{path}:{i}: id {raw_id!r} is not usable as a directory name")
+            if job_id in seen:
+                # Each job writes to <out-dir>/<id>/; two jobs there would overwrite each other's blog.docx
+                raise ValueError(f"{path}:{i}: id {raw_id!r} clashes with line {seen[job_id]} (both map to {job_id!r})")
+            seen[job_id] = i
+            jobs.append(
+                {
+                    "id": job_id,
+                    "topic": topic,
+                    "words": int(d.get("words") or d.get("target_words") or default_words),
+                }
+            )
+    return jobs
+
+
+def run_batch(
+    path: str,
+    workers: int,
+    out_root: str,
+    default_words: int,
+    use_async: bool = False,
+    mode: str = "outline",
+    trace: bool = False,
+    speculative: bool = False,
+    run_id: str | None = None,
+    resume: bool = False,
+) -> str:
+    """Run every job in a JSONL file. With run_id each job is checkpointed as "<run_id>/<job id>",
+    so re-running the batch with resume=True only pays for what failed or never finished."""
+    jobs = _load_jobs(path, default_words)
+
+    def job_kwargs(job: dict) -> dict:
+        out_dir = os.path.join(out_root, job["id"])
+        os.makedirs(out_dir, exist_ok=True)
+        return {
+            "out_dir": out_dir,
+            "trace_path": os.path.join(out_dir, "trace.json") if trace else None,
+            "mode": mode,
+            "speculative": speculative,
+            "run_id": f"{run_id}/{job['id']}" if run_id else None,
+            "resume": resume,
+        }
+
+    def start(job: dict) -> tuple[dict, float]:
+        return {"id": job["id"], "topic": job["topic"], "words": job["words"]}, time.perf_counter()
+
+    def finish(rec: dict, t0: float, out_path: str | None, err: Exception | None) -> dict:
+        if err is None:
+            rec["out_path"] = out_path
+            rec["status"] = "ok"
+        else:
+            rec["status"] = "error"
+            rec["error"] = f"{type(err).__name__}: {err}"
+        rec["seconds"] = round(time.perf_counter() - t0, 3)
+        return rec
+
+    def one(job: dict) -> dict:
+        rec, t0 = start(job)
+        try:
+            out = run(job["topic"], job["words"], **job_kwargs(job))
+        except Exception as e:
+            return finish(rec, t0, None, e)
+        return finish(rec, t0, out, None)
+
+    async def aone(job: dict, sem: asyncio.Semaphore) -> dict:
+        async with sem:
+            rec, t0 = start(job)
+            try:
+                out = await arun(job["topic"], job["words"], **job_kwargs(job))
+            except Exception as e:
+                return finish(rec, t0, None, e)
+            return finish(rec, t0, out, None)
+
+    async def arun_all() -> list[dict]:
+        sem = asyncio.Semaphore(workers)
+        return list(await asyncio.gather(*(aone(job, sem) for job in jobs)))
+
+    t0 = time.perf_counter()
+    # The graph is compiled once at import; jobs share it, the HTTP pools and the caches
+    if use_async:
+        results = asyncio.run(arun_all())
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job") as pool:
+            results = list(pool.map(one, jobs))
+
+    manifest = {
+        "batch": path,
+        "workers": workers,
+        "async": use_async,
+        "seconds": round(time.perf_counter() - t0, 3),
+        "ok": sum(r["status"] == "ok" for r in results),
+        "failed": sum(r["status"] != "ok" for r in results),
+        "jobs": results,
+    }
+    os.makedirs(out_root, exist_ok=True)
+    manifest_path = os.path.join(out_root, "manifest.json")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"Batch done: {manifest['ok']} ok, {manifest['failed']} failed in {manifest['seconds']}s -> {manifest_path}")
+    return manifest_path
+
+
 if __name__ == "__main__":
     p = argparse.ArgumentParser()
     p.add_argument("--topic", default="Retrieval-Augmented Generation (RAG)")
     p.add_argument("--words", type=int, default=1500)   # user-controlled
+    p.add_argument(
+        "--mode", choices=["outline", "delta", "expand"], default="outline",
+        help="outline: plan sections then write them in parallel; delta: only request the missing paragraphs; "
+        "expand: rewrite the whole doc (legacy)",
+    )
+    p.add_argument("--batch", help="JSONL file, one job per line: {\"topic\" (or \"title\"), \"words\", \"id\"}")
+    p.add_argument("--workers", type=int, default=4, help="Concurrent jobs (threads, or in-flight tasks with --async)")
+    p.add_argument("--async", dest="use_async", action="store_true", help="Run on one asyncio event loop (app.ainvoke)")
+    p.add_argument(
+        "--speculative", action="store_true",
+        help="Start the bootstrap search, likely follow-up searches and their image downloads up front",
+    )
+    p.add_argument("--run-id", help="Checkpoint the run under this id (SQLite, CHECKPOINT_PATH); with --batch a prefix")
+    p.add_argument("--resume", action="store_true", help="Continue --run-id from its last completed stage")
+    p.add_argument("--out-dir", help="Output directory (default: output, with --batch output/batch)")
+    p.add_argument("--trace", help="Write a JSON span trace here (with --batch: any value, one trace.json per job dir)")
+    p.add_argument("--metrics", help="Write Prometheus text metrics here when done")
+    p.add_argument("--groq-rps", type=float, help="Max Groq requests/second across all workers")
+    p.add_argument("--tavily-rps", type=float, help="Max Tavily requests/second across all workers")
+    p.add_argument("--dry-run", action="store_true", help="Validate the arguments (and --batch file), then exit")
     args = p.parse_args()
+    if args.resume and not args.run_id:
+        p.error("--resume needs --run-id")
+    if args.words <= 0:
+        p.error("--words must be positive")
+    if args.workers < 1:
+        p.error("--workers must be at least 1")
+
+    if args.dry_run:
+        if args.batch:
+            try:
+                jobs = _load_jobs(args.batch, args.words)
+            except (OSError, ValueError) as e:
+                p.error(f"--batch: {e}")
+            print(f"OK: {len(jobs)} jobs, {sum(j['words'] for j in jobs)} words total, mode={args.mode}")
+        else:
+            print(f"OK: {args.topic!r}, {args.words} words, mode={args.mode}")
+        raise SystemExit(0)
+
+    import llm
+    import tools
+
+    if args.groq_rps is not None:
+        llm.GROQ_LIMITER = llm.rate_limiter(args.groq_rps)
+    if args.tavily_rps is not None:
+        tools.TAVILY_LIMITER = llm.rate_limiter(args.tavily_rps)
+
+    if args.batch:
+        run_batch(
+            args.batch, args.workers, args.out_dir or os.path.join("output", "batch"), args.words,
+            use_async=args.use_async, mode=args.mode, trace=bool(args.trace), speculative=args.speculative,
+            run_id=args.run_id, resume=args.resume,
+        )
+        _report()
+    else:
+        kwargs = dict(
+            out_dir=args.out_dir or "output", mode=args.mode, trace_path=args.trace, speculative=args.speculative,
+            run_id=args.run_id, resume=args.resume,
+        )
+        if args.use_async:
+            out_path = asyncio.run(arun(args.topic, args.words, **kwargs))
+        else:
+            out_path = run(args.topic, args.words, **kwargs)
+        _report(out_path)
+
+    if args.metrics:
+        from telemetry import METRICS
 
-    run(args.topic, args.words)
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            f.write(METRICS.prometheus())
@@ -0,0 +1,194 @@
+# asset_store.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+SAVE_EVERY_HITS = 64  # cache hits only refresh LRU order; the index is persisted in batches of this many
+
+
+class AssetStore:
+    """Persistent, content-addressed image store shared by every run.
+
+    URLs map to a sha256 of the stored bytes, identical payloads are written
+    once, and asset_id is derived from the hash so it is stable across runs.
+    Transformed variants (e.g. resized images) are remembered by the hash of
+    the raw payload, so the same download is never transformed twice.
+    Blobs are evicted least-recently-used once the store exceeds max_bytes.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_path = root / "index.json"
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._unsaved_hits = 0
+        self._lock = threading.RLock()
+        self._index: Optional[dict] = None
+
+    def _load(self) -> dict:
+        if self._index is None:
+            try:
+                self._index = json.loads(self.index_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self._index = {}
+            self._index.setdefault("urls", {})
+            self._index.setdefault("blobs", {})
+            self._index.setdefault("variants", {})
+        return self._index
+
+    def _save(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(self._index, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.index_path)
+        self._unsaved_hits = 0
+
+    def flush(self) -> None:
+        """Persist LRU recency from hits not yet written (see SAVE_EVERY_HITS)."""
+        with self._lock:
+            if self._unsaved_hits:
+                self._save()
+
+    def _asset(self, digest: str, url: str) -> dict:
+        blob = self._load()["blobs"][digest]
+        path = (self.root / blob["file"]).resolve()
+        asset = {"asset_id": f"img_{digest[:12]}", "path": str(path), "source_url": url}
+        asset.update(blob.get("meta") or {})
+        return asset
+
+    def lookup(self, url: str, count: bool = True) -> Optional[dict]:
+        """Return the cached asset for url, or None (counted as a hit or miss unless count is False).
+
+        A hit only touches the in-memory index; it reaches disk with the next put or every SAVE_EVERY_HITS hits.
+        """
+        with self._lock:
+            index = self._load()
+            digest = index["urls"].get(url)
+            blob = index["blobs"].get(digest) if digest else None
+            if blob is None or not (self.root / blob["file"]).exists():
+                if digest:
+                    index["urls"].pop(url, None)
+                    index["blobs"].pop(digest, None)
+                if count:
+                    self.misses += 1
+                return None
+            blob["used"] = time.time()
+            if count:
+                self.hits += 1
+            self._unsaved_hits += 1
+            if self._unsaved_hits >= SAVE_EVERY_HITS:
+                self._save()
+            return self._asset(digest, url)
+
+    def count(self, hit: bool) -> None:
+        """Record a hit or miss for a lookup made with count=False."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put_file(
+        self,
+        url: str,
+        src: Path,
+        digest: str,
+        ext: str,
+        transform: Optional[Callable[[Path], tuple[bytes, str]]] = None,
+        variant: str = "",
+        meta: Optional[dict] = None,
+    ) -> dict:
+        """Store the payload already written to src (a temp file under root; digest is its sha256) for url,
+        deduplicated by content, or transform(src) -> (bytes, ext) of it, remembered per variant.
+
+        Untransformed payloads are moved into place, never read back into memory; src is gone afterwards.
+        meta (e.g. size and perceptual hash of the original) is kept with the blob and merged into the asset.
+        """
+        try:
+            if transform is not None:
+                return self._transformed(url, digest, variant, lambda: transform(src), meta)
+            return self._commit(url, digest, ext, meta, lambda dest: os.replace(src, dest))
+        finally:
+            src.unlink(missing_ok=True)
+
+    def _transformed(self, url: str, digest: str, variant: str, transform: Callable[[], tuple[bytes, str]], meta):
+        variant_key = f"{digest}:{variant}"
+        with self._lock:
+            index = self._load()
+            stored = index["variants"].get(variant_key)
+            blob = index["blobs"].get(stored) if stored else None
+            if blob is not None and (self.root / blob["file"]).exists():
+                blob["used"] = time.time()
+                index["urls"][url] = stored
+                self._save()
+                return self._asset(stored, url)
+        data, ext = transform()  # outside the lock: can be slow
+        asset = self._put(url, data, ext, meta)
+        with self._lock:
+            self._index["variants"][variant_key] = hashlib.sha256(data).hexdigest()
+            self._save()
+        return asset
+
+    def _put(self, url: str, data: bytes, ext: str, meta: Optional[dict] = None) -> dict:
+        def write(dest: Path) -> None:
+            tmp = self.root / f".{dest.name}.{threading.get_ident()}.part"
+            tmp.write_bytes(data)
+            os.replace(tmp, dest)
+
+        return self._commit(url, hashlib.sha256(data).hexdigest(), ext, meta, write)
+
+    def _commit(self, url: str, digest: str, ext: str, meta: Optional[dict], place: Callable[[Path], None]) -> dict:
+        with self._lock:
+            index = self._load()
+            blob = index["blobs"].get(digest)
+            if blob is None or not (self.root / blob["file"]).exists():
+                name = f"img_{digest[:12]}{ext}"
+                self.root.mkdir(parents=True, exist_ok=True)
+                place(self.root / name)
+                blob = {"file": name, "size": (self.root / name).stat().st_size}
+                index["blobs"][digest] = blob
+            if meta:
+                blob["meta"] = meta
+            blob["used"] = time.time()
+            index["urls"][url] = digest
+            self._evict(keep=digest)
+            self._save()
+            return self._asset(digest, url)
+
+    def _evict(self, keep: str) -> None:
+        blobs = self._load()["blobs"]
+        total = sum(b["size"] for b in blobs.values())
+        for digest, blob in sorted(blobs.items(), key=lambda kv: kv[1].get("used", 0)):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            try:
+                (self.root / blob["file"]).unlink()
+            except FileNotFoundError:
+                pass
+            total -= blob["size"]
+            del blobs[digest]
+            self.evictions += 1
+        for mapping in (self._index["urls"], self._index["variants"]):
+            for k in [k for k, d in mapping.items() if d not in blobs]:
+                del mapping[k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            blobs = self._load()["blobs"]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "blobs": len(blobs),
+                "bytes": sum(b["size"] for b in blobs.values()),
+            }
@@ -0,0 +1,77 @@
+# checkpoint.py
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+BASE_DIR = Path(__file__).resolve().parent
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", str(BASE_DIR / "output" / "checkpoints.sqlite"))
+
+
+@lru_cache(maxsize=None)
+def _connect(path: str) -> tuple[sqlite3.Connection, threading.Lock]:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS run_stages ("
+        "run_id TEXT, stage TEXT, payload TEXT, saved_at REAL, PRIMARY KEY (run_id, stage))"
+    )
+    conn.commit()
+    return conn, threading.Lock()
+
+
+class RunCheckpoint:
+    """Results of the post-graph stages (longform, expansions, render) for one run id.
+
+    The agent loop itself is checkpointed by LangGraph's SqliteSaver under the
+    same thread id and in the same file; this table covers what runs after it.
+    """
+
+    def __init__(self, run_id: str, path: str = CHECKPOINT_PATH):
+        self.run_id = run_id
+        self.path = path
+        self._conn, self._lock = _connect(path)  # one connection per file, shared by all runs
+
+    def get(self, stage: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM run_stages WHERE run_id = ? AND stage = ?", (self.run_id, stage)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, stage: str, value: Any) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO run_stages VALUES (?, ?, ?, ?)",
+                (self.run_id, stage, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM run_stages WHERE run_id = ?", (self.run_id,))
+            self._conn.commit()
+
+    def stage(self, name: str, fn: Callable[[], Any]) -> Any:
+        """Return the saved result of stage name, or run fn and save it."""
+        saved = self.get(name)
+        if saved is not None:
+            return saved
+        value = fn()
+        self.put(name, value)
+        return value
+
+    async def astage(self, name: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        saved = self.get(name)
+        if saved is not None:
+            return saved
+        value = await fn()
+        self.put(name, value)
+        return value
@@ -0,0 +1,107 @@
+# dedup.py
+from __future__ import annotations
+
+import math
+import os
+import re
+import zlib
+from typing import Optional
+from urllib.parse import urlsplit
+
+# Share of the smaller text's shingles found in the other one for the pair to count as the same page
+DUP_OVERLAP = float(os.getenv("DEDUP_OVERLAP", "0.6"))
+SHINGLE_WORDS = 3
+
+_WORD = re.compile(r"\w+")
+_STOP = frozenset(
+    "a an and are as at be by for from how in is it of on or that the this to what why with vs png jpg".split()
+)
+
+
+def _words(text: str) -> list[str]:
+    return _WORD.findall(str(text).lower())
+
+
+def shingles(text: str, k: int = SHINGLE_WORDS) -> frozenset[int]:
+    """Hashed k-word shingles; texts shorter than k words fall back to their word set."""
+    words = _words(text)
+    if len(words) < k:
+        return frozenset(zlib.crc32(w.encode()) for w in words)
+    return frozenset(zlib.crc32(" ".join(words[i : i + k]).encode()) for i in range(len(words) - k + 1))
+
+
+def overlap(a: frozenset[int], b: frozenset[int]) -> float:
+    # Containment rather than Jaccard: a mirror cut at a different length is still a copy
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def canonical_url(url: str) -> str:
+    parts = urlsplit(str(url).strip().lower())
+    host = parts.netloc.removeprefix("www.")
+    return f"{host}{parts.path.rstrip('/')}"
+
+
+class NearDuplicates:
+    """Pages seen so far, keyed by a label; find() names the earlier page a new one repeats."""
+
+    def __init__(self, threshold: float = DUP_OVERLAP):
+        self.threshold = threshold
+        self._urls: dict[str, str] = {}
+        self._sigs: list[tuple[str, frozenset[int]]] = []
+
+    def find(self, url: str, text: str) -> Optional[str]:
+        label = self._urls.get(canonical_url(url)) if url else None
+        if label is not None:
+            return label
+        sig = shingles(text)
+        for label, seen in self._sigs:
+            if overlap(sig, seen) >= self.threshold:
+                return label
+        return None
+
+    def add(self, label: str, url: str, text: str) -> None:
+        if url:
+            self._urls.setdefault(canonical_url(url), label)
+        sig = shingles(text)
+        if sig:
+            self._sigs.append((label, sig))
+
+
+def relevance(query: str, docs: list[str]) -> list[float]:
+    """BM25-style lexical score of each doc against the query, IDF taken over the docs themselves."""
+    terms = [t for t in dict.fromkeys(_words(query)) if t not in _STOP and len(t) > 1]
+    bags = [_words(d) for d in docs]
+    if not terms or not bags:
+        return [0.0] * len(docs)
+    avg_len = sum(len(b) for b in bags) / len(bags) or 1.0
+    n = len(bags)
+    sets = [set(b) for b in bags]
+    idf = {}
+    for t in terms:
+        df = sum(t in s for s in sets)
+        idf[t] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+    scores = []
+    for bag in bags:
+        score = 0.0
+        for t in terms:
+            tf = bag.count(t)
+            if tf:
+                score += idf[t] * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * len(bag) / avg_len))
+        scores.append(score)
+    return scores
+
+
+def distinct_ranked(query: str, results: list[dict], limit: int) -> list[dict]:
+    """Search results without near-duplicates, most relevant to the query first (ties keep engine order)."""
+    seen = NearDuplicates()
+    kept: list[dict] = []
+    for r in results:
+        text = f"{r.get('title') or ''} {r.get('content') or ''}"
+        if seen.find(r.get("url") or "", text) is None:
+            seen.add(str(len(kept)), r.get("url") or "", text)
+            kept.append(r)
+    scores = relevance(query, [f"{r.get('title') or ''} {r.get('title') or ''} {r.get('content') or ''}" for r in kept])
+    order = sorted(range(len(kept)), key=lambda i: -scores[i])
+    return [kept[i] for i in order[:limit]]
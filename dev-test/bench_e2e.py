@@ -0,0 +1,272 @@
+# dev-test/bench_e2e.py
+# Offline end-to-end benchmark: fake chat model, fake Tavily, local image server.
+#
+#   python dev-test/bench_e2e.py --out bench_before.json
+#   python dev-test/bench_e2e.py --compare bench_before.json
+#
+# Every scenario drives app.run (and so graph.app) exactly like the CLI does.
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# Must be set before the project modules are imported
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["LANGSMITH_TRACING"] = "false"
+os.environ.setdefault("TAVILY_API_KEY", "offline")
+os.environ.setdefault("GROQ_API_KEY", "offline")
+os.environ.setdefault("FAKE_LLM_LATENCY_S", "0.25")
+os.environ.setdefault("FAKE_LLM_TOKENS_PER_S", "400")
+
+import argparse
+import contextlib
+import io
+import json
+import resource
+import subprocess
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+import app
+import llm
+import nodes
+import tools
+from asset_store import AssetStore
+from search_cache import SearchCache
+
+
+# ---------- local stand-ins ----------
+
+def _png(seed: int, size: tuple[int, int]) -> bytes:
+    img = Image.new("RGB", size, ((seed * 67) % 256, (seed * 131) % 256, (seed * 29) % 256))
+    for x in range(0, size[0], 40):
+        for y in range(size[1]):
+            img.putpixel((x, y), (255, 255, 255))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class ImageServer:
+    """Serves /img/<n>.png after a fixed delay, like a slow CDN."""
+
+    def __init__(self, n_images: int, latency_s: float):
+        self.images = {f"/img/{i}.png": _png(i, (1600, 1000)) for i in range(n_images)}
+        latency = latency_s
+        images = self.images
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                time.sleep(latency)
+                body = images.get(self.path.split("?")[0])
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+class FakeTavily:
+    """Stands in for TavilySearch: same response shape, local image URLs, fixed latency."""
+
+    def __init__(self, image_base: str, n_images: int, latency_s: float):
+        self.image_base = image_base
+        self.n_images = n_images
+        self.latency_s = latency_s
+
+    def _data(self, query: str) -> dict:
+        words = query.split()
+        return {
+            "query": query,
+            "results": [
+                {
+                    "title": f"{query} — source {i}",
+                    "url": f"https://example.com/{i}/{'-'.join(words[:3])}",
+                    "content": f"Source {i} explains {query} in depth. " * 30,
+                }
+                for i in range(5)
+            ],
+            "images": [
+                {"url": f"{self.image_base}/img/{i}.png", "description": f"diagram {i}"} for i in range(self.n_images)
+            ],
+        }
+
+    def invoke(self, payload: dict) -> dict:
+        time.sleep(self.latency_s)
+        return self._data(payload["query"])
+
+    async def ainvoke(self, payload: dict) -> dict:
+        import asyncio
+
+        await asyncio.sleep(self.latency_s)
+        return self._data(payload["query"])
+
+
+# ---------- harness ----------
+
+def fresh_caches(tmp: Path) -> None:
+    tmp.mkdir(parents=True, exist_ok=True)
+    tools.ASSET_STORE = AssetStore(tmp / "assets", max_bytes=1 << 30)
+    tools.SEARCH_CACHE = SearchCache(tmp / "search.sqlite", ttl_s=3600, stale_s=3600, max_entries=1000)
+    llm.LLM_CACHE = llm.MemoryResponseCache()
+
+
+def percentile(xs: list[float], p: float) -> float:
+    xs = sorted(xs)
+    k = (len(xs) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+def scenario(name: str, runs: list, concurrency: int = 1) -> dict:
+    """runs: zero-arg callables; each is one app.run. Returns latency/throughput/memory stats."""
+    latencies: list[float] = []
+
+    def timed(fn):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    # One redirect for the whole scenario: redirect_stdout is process-global, not per thread
+    with contextlib.redirect_stdout(io.StringIO()):
+        if concurrency == 1:
+            for fn in runs:
+                timed(fn)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(timed, runs))
+    wall = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "scenario": name,
+        "runs": len(latencies),
+        "concurrency": concurrency,
+        "p50_s": round(percentile(latencies, 0.50), 4),
+        "p95_s": round(percentile(latencies, 0.95), 4),
+        "throughput_rps": round(len(latencies) / wall, 3),
+        "peak_py_mem_mb": round(peak / 2**20, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    p.add_argument("--repeat", type=int, default=5, help="Runs per scenario")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--image-latency", type=float, default=0.3)
+    p.add_argument("--search-latency", type=float, default=0.4)
+    p.add_argument("--out", help="Write the JSON report here")
+    p.add_argument("--compare", help="Previous JSON report to diff against")
+    args = p.parse_args()
+    out_path = Path(args.out).resolve() if args.out else None
+    compare_path = Path(args.compare).resolve() if args.compare else None
+
+    server = ImageServer(n_images=8, latency_s=args.image_latency)
+    tools._tavily = FakeTavily(server.base, n_images=8, latency_s=args.search_latency)
+    work = Path(tempfile.mkdtemp(prefix="bench_e2e_"))
+    os.chdir(work)
+
+    def job(topic: str, words: int, tag: str):
+        return lambda: app.run(topic, words, out_dir=str(work / "out" / tag))
+
+    results = []
+
+    runs = []
+    for i in range(args.repeat):
+        runs.append(lambda i=i: (fresh_caches(work / f"cold{i}"), job(f"Cold topic {i}", 1500, f"cold{i}")()))
+    results.append(scenario("cold", runs))
+
+    fresh_caches(work / "warm")
+    with contextlib.redirect_stdout(io.StringIO()):
+        job("Warm topic", 1500, "warm-prime")()
+    results.append(scenario("warm_cache", [job("Warm topic", 1500, f"warm{i}") for i in range(args.repeat)]))
+
+    fresh_caches(work / "big")
+    results.append(scenario("big_words_4000", [job(f"Big topic {i}", 4000, f"big{i}") for i in range(args.repeat)]))
+
+    fresh_caches(work / "many")
+    saved = nodes.MAX_IMAGES
+    nodes.MAX_IMAGES = 6
+    try:
+        results.append(scenario("many_images_6", [job(f"Image topic {i}", 1500, f"img{i}") for i in range(args.repeat)]))
+    finally:
+        nodes.MAX_IMAGES = saved
+
+    fresh_caches(work / "conc")
+    n = args.repeat * args.concurrency
+    results.append(
+        scenario(
+            f"concurrent_x{args.concurrency}",
+            [job(f"Concurrent topic {i}", 1500, f"conc{i}") for i in range(n)],
+            concurrency=args.concurrency,
+        )
+    )
+
+    report = {
+        "git": git_rev(),
+        "python": sys.version.split()[0],
+        "settings": {
+            "llm_latency_s": float(os.environ["FAKE_LLM_LATENCY_S"]),
+            "llm_tokens_per_s": float(os.environ["FAKE_LLM_TOKENS_PER_S"]),
+            "image_latency_s": args.image_latency,
+            "search_latency_s": args.search_latency,
+            "repeat": args.repeat,
+        },
+        "scenarios": results,
+    }
+
+    print(f"{'scenario':<18}{'runs':>5}{'p50 s':>9}{'p95 s':>9}{'runs/s':>9}{'py MB':>8}{'rss MB':>8}")
+    before = {}
+    if compare_path:
+        before = {s["scenario"]: s for s in json.loads(compare_path.read_text())["scenarios"]}
+    for r in results:
+        line = (
+            f"{r['scenario']:<18}{r['runs']:>5}{r['p50_s']:>9.3f}{r['p95_s']:>9.3f}"
+            f"{r['throughput_rps']:>9.2f}{r['peak_py_mem_mb']:>8.1f}{r['max_rss_mb']:>8.0f}"
+        )
+        old = before.get(r["scenario"])
+        if old:
+            line += f"   p50 {100 * (r['p50_s'] / old['p50_s'] - 1):+.0f}%  runs/s {100 * (r['throughput_rps'] / old['throughput_rps'] - 1):+.0f}%"
+        print(line)
+
+    if out_path:
+        out_path.write_text(json.dumps(report, indent=2))
+        print("Report:", out_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# dev-test/bench_memory.py
+# Peak RSS per concurrent run: N agent runs at once (threads, or one event loop with --async),
+# each level in a fresh process because ru_maxrss only ever goes up.
+#
+#   python dev-test/bench_memory.py
+#   python dev-test/bench_memory.py --levels 1 8 32 --max-steps 12 --async
+#
+# The fake model keeps searching until the step budget forces the final answer, so the
+# agent state grows the way it does on research-heavy topics.
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import bench_e2e  # sets the offline env (fake model, no tracing) before the project modules load
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import resource
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+import llm
+import nodes
+import step_store
+import tools
+
+
+def keep_searching(prompt: str) -> str:
+    if "Tool call format" in prompt:
+        q = hashlib.sha1(prompt.encode()).hexdigest()[:8]
+        return f'Thought: need more sources\nAction: web_search\nAction Input: "angle {q}"'
+    return llm.fake_reply(prompt)
+
+
+def rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(n: int, use_async: bool, max_steps: int) -> dict:
+    server = bench_e2e.ImageServer(n_images=8, latency_s=0.05)
+    tools._tavily = bench_e2e.FakeTavily(server.base, n_images=8, latency_s=0.05)
+    work = Path(tempfile.mkdtemp(prefix="bench_memory_"))
+    bench_e2e.fresh_caches(work)
+    step_store.STEP_STORE = step_store.StepStore(work / "steps.sqlite", max_entries=100_000)
+    llm.FAKE_REPLY_FN = keep_searching
+    nodes.MAX_TOTAL_TOOL_STEPS = max_steps
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.run("Warm-up topic", 800, out_dir=str(work / "warm"))  # imports, pools, caches
+        base = rss_mb()
+        if use_async:
+            async def all_runs():
+                await asyncio.gather(
+                    *(app.arun(f"Topic {i}", 1500, out_dir=str(work / f"out{i}")) for i in range(n))
+                )
+
+            asyncio.run(all_runs())
+        else:
+            with ThreadPoolExecutor(max_workers=n) as pool:
+                list(pool.map(lambda i: app.run(f"Topic {i}", 1500, out_dir=str(work / f"out{i}")), range(n)))
+    peak = rss_mb()
+    return {
+        "concurrency": n,
+        "mode": "async" if use_async else "threads",
+        "baseline_rss_mb": round(base, 1),
+        "peak_rss_mb": round(peak, 1),
+        "per_run_mb": round((peak - base) / n, 2),
+        "step_store": step_store.STEP_STORE.stats(),
+    }
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    p.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16], help="Concurrent runs per measurement")
+    p.add_argument("--async", dest="use_async", action="store_true", help="arun on one event loop instead of threads")
+    p.add_argument("--max-steps", type=int, default=12, help="Tool calls per run before the final answer (graph recursion limit allows ~14)")
+    p.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(child(args.child, args.use_async, args.max_steps)))
+        return
+
+    print(f"{'runs':>5}{'mode':>9}{'base MB':>10}{'peak MB':>10}{'MB/run':>9}")
+    for n in args.levels:
+        argv = [sys.executable, __file__, "--child", str(n), "--max-steps", str(args.max_steps)]
+        if args.use_async:
+            argv.append("--async")
+        out = subprocess.run(argv, capture_output=True, text=True, env={**os.environ, "LANGSMITH_TRACING": "false"})
+        if out.returncode != 0:
+            print(f"{n:>5}  failed:\n{out.stderr[-2000:]}")
+            continue
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{n:>5}{r['mode']:>9}{r['baseline_rss_mb']:>10}{r['peak_rss_mb']:>10}{r['per_run_mb']:>9}")
+
+
+if __name__ == "__main__":
+    main()
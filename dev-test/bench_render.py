@@ -0,0 +1,63 @@
+# dev-test/bench_render.py
+# Documents/second for render_docx: fresh Document() vs cached template, disk vs BytesIO, process pool.
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import argparse
+import os
+
+from docx import Document
+
+import renderer
+from renderer import render_docx, render_docx_bytes, render_many
+
+
+def make_spec(i: int, assets: list[str]) -> dict:
+    return {
+        "title": f"Benchmark post {i}",
+        "subtitle": "Rendering throughput",
+        "sections": [
+            {
+                "heading": f"Section {s}",
+                "paragraphs": [f"Paragraph {p} of section {s}. " * 12 for p in range(4)],
+                "images": [{"asset_id": assets[s], "caption": f"Figure {s}"}] if s < len(assets) else [],
+            }
+            for s in range(5)
+        ],
+        "references": [{"title": "Example", "url": "https://example.com"}],
+    }
+
+
+def bench(label: str, n: int, fn) -> None:
+    t0 = time.perf_counter()
+    fn()
+    dt = time.perf_counter() - t0
+    print(f"{label:<34} {n / dt:8.1f} docs/s  ({dt * 1000 / n:6.1f} ms/doc)")
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("-n", type=int, default=60)
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    args = p.parse_args()
+
+    pngs = sorted((ROOT / "output" / "assets").glob("*.png"))[:2]
+    assets_by_id = {f"img_{i}": {"asset_id": f"img_{i}", "path": str(pth), "source_url": ""} for i, pth in enumerate(pngs)}
+    specs = [make_spec(i, list(assets_by_id)) for i in range(args.n)]
+    out = Path(tempfile.mkdtemp())
+
+    template = renderer._base_template
+    renderer._base_template = Document  # uncached: re-parse the default template every render
+    bench("fresh Document() -> disk", args.n, lambda: [render_docx(s, assets_by_id, str(out / f"a{i}.docx")) for i, s in enumerate(specs)])
+    renderer._base_template = template
+
+    bench("cached template -> disk", args.n, lambda: [render_docx(s, assets_by_id, str(out / f"b{i}.docx")) for i, s in enumerate(specs)])
+    bench("cached template -> BytesIO", args.n, lambda: [render_docx_bytes(s, assets_by_id) for s in specs])
+    jobs = [(s, assets_by_id, str(out / f"c{i}.docx")) for i, s in enumerate(specs)]
+    bench(f"process pool x{args.workers} -> disk", args.n, lambda: render_many(jobs, workers=args.workers))
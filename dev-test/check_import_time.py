@@ -0,0 +1,101 @@
+# dev-test/check_import_time.py
+# Import-time budget: fails (exit 1) when start-up gets slow or a heavy dependency
+# sneaks back into an import path that should stay light.
+#
+#   python dev-test/check_import_time.py
+#   python dev-test/check_import_time.py --scale 2     # slower machine / CI
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# (name, argv, budget_ms, modules that must NOT be imported)
+# -X importtime checks are measured as the module's cumulative import time; the others as wall
+# time minus a bare interpreter start (site-packages .pth files make that vary a lot by machine).
+CHECKS = [
+    (
+        "import app",
+        ["-X", "importtime", "-c", "import app"],
+        150,
+        ["langchain_core", "langgraph", "langchain_groq", "langchain_tavily", "PIL", "docx", "httpx", "requests"],
+    ),
+    ("app.py --help", ["app.py", "--help"], 250, []),
+    ("app.py --dry-run --batch", ["app.py", "--dry-run", "--batch", "{jobs}"], 250, []),
+    (
+        "import tools",
+        ["-X", "importtime", "-c", "import tools"],
+        800,  # ~550-660 ms measured; the eager-import baseline was ~870
+        ["langchain_tavily", "PIL", "httpx"],  # requests comes in with langsmith anyway
+    ),
+]
+
+
+def importtime_modules(stderr: str) -> dict[str, int]:
+    """module -> cumulative microseconds, from python -X importtime output."""
+    out = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line.split(":", 1)[1].split("|"))
+        out[name] = int(cumulative)
+    return out
+
+
+def best_run(argv: list[str], env: dict, repeat: int) -> tuple[float, subprocess.CompletedProcess]:
+    best, best_proc = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, *argv], cwd=ROOT, env=env, capture_output=True, text=True)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if proc.returncode != 0:
+            return elapsed, proc
+        if elapsed < best:
+            best, best_proc = elapsed, proc
+    return best, best_proc
+
+
+def main() -> int:
+    p = argparse.ArgumentParser()
+    p.add_argument("--scale", type=float, default=1.0, help="Multiply every budget")
+    p.add_argument("--repeat", type=int, default=3, help="Best of N runs")
+    args = p.parse_args()
+
+    jobs = Path(tempfile.mkdtemp()) / "jobs.jsonl"
+    jobs.write_text('{"topic": "a", "words": 800}\n{"topic": "b"}\n', encoding="utf-8")
+    env = {**os.environ, "LANGSMITH_TRACING": "false"}
+
+    baseline, _ = best_run(["-c", "pass"], env, args.repeat)
+    print(f"interpreter start: {baseline:.0f} ms (subtracted from wall-time checks)")
+
+    failed = False
+    print(f"{'check':<28}{'ms':>7}{'budget':>8}  result")
+    for name, argv, budget_ms, forbidden in CHECKS:
+        argv = [a.format(jobs=jobs) for a in argv]
+        wall, proc = best_run(argv, env, args.repeat)
+        if proc.returncode != 0:
+            print(f"{name:<28}{'-':>7}{'-':>8}  FAIL (exit {proc.returncode})\n{proc.stderr[-2000:]}")
+            failed = True
+            continue
+        loaded = importtime_modules(proc.stderr)
+        target = argv[-1].removeprefix("import ") if "importtime" in argv else None
+        ms = loaded[target] / 1000 if target else max(0.0, wall - baseline)
+        budget = budget_ms * args.scale
+        leaked = sorted(m for m in forbidden if m in loaded)
+        ok = ms <= budget and not leaked
+        failed |= not ok
+        note = "ok" if ok else " ".join(filter(None, ["over budget" if ms > budget else "", f"imports {leaked}" if leaked else ""]))
+        print(f"{name:<28}{ms:>7.0f}{budget:>8.0f}  {note}")
+        if loaded and not ok:
+            for mod, us in sorted(loaded.items(), key=lambda kv: -kv[1])[:8]:
+                print(f"    {us / 1000:>8.1f} ms  {mod}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,18 @@
 from __future__ import annotations
 
+import functools
+import os
+import sqlite3
+from contextlib import asynccontextmanager
 from typing import Literal
 
 from langchain_core.agents import AgentFinish
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, START, END
 
+from checkpoint import CHECKPOINT_PATH
 from state import AgentState
-from nodes import reason_node, act_node
+from nodes import reason_node, areason_node, act_node, aact_node
 
 
 def should_continue(state: AgentState) -> Literal["act", END]:
@@ -16,11 +22,53 @@ def should_continue(state: AgentState) -> Literal["act", END]:
 
 
 builder = StateGraph(AgentState)
-builder.add_node("reason", reason_node)
-builder.add_node("act", act_node)
+# Each node has a sync and an async body: app.invoke() uses the first, app.ainvoke() the second
+builder.add_node("reason", RunnableLambda(reason_node, afunc=areason_node, name="reason"))
+builder.add_node("act", RunnableLambda(act_node, afunc=aact_node, name="act"))
 
 builder.add_edge(START, "reason")
 builder.add_conditional_edges("reason", should_continue)
 builder.add_edge("act", "reason")
 
 app = builder.compile()
+
+
+def _serde():
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+    # agent_outcome holds AgentAction / AgentFinish objects, intermediate_steps Step records
+    return JsonPlusSerializer(
+        allowed_msgpack_modules=[
+            ("langchain_core.agents", "AgentAction"),
+            ("langchain_core.agents", "AgentFinish"),
+            ("state", "Step"),
+        ]
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def checkpointed_app(path: str = CHECKPOINT_PATH):
+    """The same graph with a SQLite checkpointer; runs need config["configurable"]["thread_id"].
+
+    Opt-in: needs langgraph-checkpoint-sqlite. One connection per path, shared by every thread
+    (SqliteSaver serializes access itself).
+    """
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    saver = SqliteSaver(sqlite3.connect(path, check_same_thread=False), serde=_serde())
+    saver.setup()
+    return builder.compile(checkpointer=saver)
+
+
+@asynccontextmanager
+async def acheckpointed_app(path: str = CHECKPOINT_PATH):
+    """Async counterpart of checkpointed_app(); the saver is bound to the running event loop."""
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    async with aiosqlite.connect(path) as conn:
+        saver = AsyncSqliteSaver(conn, serde=_serde())
+        await saver.setup()
+        yield builder.compile(checkpointer=saver)
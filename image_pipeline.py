@@ -0,0 +1,111 @@
+# image_pipeline.py
+from __future__ import annotations
+
+import os
+from io import BytesIO
+from pathlib import Path
+from typing import Optional, Union
+
+DISPLAY_WIDTH_IN = 6.0  # renderer embeds every picture at this width
+TARGET_DPI = int(os.getenv("IMAGE_TARGET_DPI", "150"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+NORMALIZE = os.getenv("IMAGE_NORMALIZE", "1").lower() not in {"0", "false", "no"}
+# dHash bits (of 64) two pictures may differ in and still count as the same image at another size/encoding
+DUP_HAMMING = int(os.getenv("IMAGE_DUP_HAMMING", "10"))
+MAGIC_BYTES = 12  # enough of the file start to tell PNG, JPEG and WebP apart
+
+# Encoded image in memory, or a file holding one (decoded from disk, never read whole)
+Source = Union[bytes, Path]
+
+
+def _open(source: Source):
+    from PIL import Image
+
+    return Image.open(BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """MIME type from the magic bytes at the start of a file, or None for anything but PNG/JPEG/WebP."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _has_alpha(img) -> bool:
+    if img.mode in ("RGBA", "LA", "PA"):
+        return img.getchannel("A").getextrema()[0] < 255
+    return img.mode == "P" and "transparency" in img.info
+
+
+def normalize_image(source: Source, dpi: int = TARGET_DPI) -> tuple[bytes, str]:
+    """Downscale to the pixels needed at DISPLAY_WIDTH_IN x dpi, drop metadata, keep the smaller of PNG/JPEG.
+
+    Returns (bytes, extension).
+    """
+    from PIL import Image, ImageOps  # lazy: only image downloads need Pillow
+
+    img = _open(source)
+    img = ImageOps.exif_transpose(img)  # bake orientation in before EXIF is dropped
+    alpha = _has_alpha(img)
+    img = img.convert("RGBA" if alpha else "RGB")
+
+    max_w = int(DISPLAY_WIDTH_IN * dpi)
+    if img.width > max_w:
+        img = img.resize((max_w, max(1, round(img.height * max_w / img.width))), Image.LANCZOS)
+
+    # Re-encoding without passing info/exif/icc strips all metadata
+    candidates = []
+    buf = BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    candidates.append((buf.getvalue(), ".png"))
+    if not alpha:
+        buf = BytesIO()
+        img.save(buf, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        candidates.append((buf.getvalue(), ".jpg"))
+    return min(candidates, key=lambda c: len(c[0]))
+
+
+def image_size(head: bytes) -> Optional[tuple[int, int]]:
+    """(width, height) from the first bytes of an image file, or None; only the header is parsed."""
+    from PIL import Image
+
+    try:
+        return Image.open(BytesIO(head)).size
+    except Exception:
+        return None
+
+
+def to_png(source: Source) -> tuple[bytes, str]:
+    """Re-encode as PNG (python-docx cannot embed WebP)."""
+    buf = BytesIO()
+    _open(source).convert("RGB").save(buf, format="PNG")
+    return buf.getvalue(), ".png"
+
+
+def image_info(source: Source) -> dict:
+    """width, height and a 64-bit difference hash (dHash) of a complete image."""
+    from PIL import Image
+
+    img = _open(source)
+    width, height = img.size
+    img.draft("L", (64, 64))  # JPEG: decode at 1/8 scale, the hash only needs 9x8 pixels
+    px = list(img.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return {"width": width, "height": height, "dhash": f"{bits:016x}"}
+
+
+def near_duplicate(a: Optional[str], b: Optional[str], max_bits: int = DUP_HAMMING) -> bool:
+    if not a or not b:
+        return False
+    x, y = int(a, 16), int(b, 16)
+    # Flat images (blank, single colour) hash to almost all-0 or all-1 bits; those say nothing
+    if min(x.bit_count(), y.bit_count()) <= 2 or max(x.bit_count(), y.bit_count()) >= 62:
+        return False
+    return (x ^ y).bit_count() <= max_bits
@@ -0,0 +1,414 @@
+# llm.py
+from __future__ import annotations
+
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+from resilience import LLM_TIMEOUT_S, ResilientChatModel, latency_stats
+from telemetry import LLM_TELEMETRY
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+def _cache_key(prompt: str, llm_string: str) -> str:
+    # llm_string carries model name and every sampling parameter (temperature, max_tokens, ...)
+    return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class MemoryResponseCache(BaseCache):
+    """In-process LRU response cache with hit/miss counters."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data: OrderedDict[str, RETURN_VAL_TYPE] = OrderedDict()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = _cache_key(prompt, llm_string)
+        with self._lock:
+            val = self._data.get(key)
+            if val is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return val
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = _cache_key(prompt, llm_string)
+        with self._lock:
+            self._data[key] = return_val
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": len(self._data),
+        }
+
+
+class SQLiteResponseCache(BaseCache):
+    """On-disk LRU response cache; survives restarts so re-runs of a topic are free."""
+
+    def __init__(self, path: Path, max_entries: int = 20000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, texts TEXT, used_at REAL)"
+            )
+        return self._conn
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = _cache_key(prompt, llm_string)
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT texts FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            db.execute("UPDATE llm_cache SET used_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return [ChatGeneration(message=AIMessage(content=t)) for t in json.loads(row[0])]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        texts = json.dumps([g.text for g in return_val], ensure_ascii=False)
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?)",
+                (_cache_key(prompt, llm_string), texts, time.time()),
+            )
+            db.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM llm_cache")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._db().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": entries,
+        }
+
+
+def _make_cache() -> Optional[BaseCache]:
+    backend = os.getenv("LLM_CACHE", "memory").lower()
+    max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+    if backend in {"off", "none", "0"}:
+        return None
+    if backend in {"sqlite", "disk"}:
+        path = Path(os.getenv("LLM_CACHE_PATH", str(BASE_DIR / "output" / "llm_cache.sqlite")))
+        return SQLiteResponseCache(path, max_entries=max_entries)
+    return MemoryResponseCache(max_entries=max_entries)
+
+
+LLM_CACHE = _make_cache()
+
+
+def rate_limiter(rps: float) -> Optional[InMemoryRateLimiter]:
+    """Process-wide token bucket shared by all callers of one provider; rps <= 0 disables it."""
+    if rps <= 0:
+        return None
+    return InMemoryRateLimiter(requests_per_second=rps, check_every_n_seconds=0.05, max_bucket_size=max(1.0, rps))
+
+
+GROQ_LIMITER = rate_limiter(float(os.getenv("GROQ_RPS", "0")))
+
+
+def llm_cache_stats() -> dict:
+    return LLM_CACHE.stats() if LLM_CACHE is not None else {"backend": "off"}
+
+
+# ---------- deterministic local stand-in ----------
+
+STREAM_CHUNK_CHARS = 16  # ~4 tokens per streamed delta
+
+_FILLER = (
+    "This paragraph explains how {topic} works in practice, which trade-offs matter, "
+    "and what a team should measure before adopting it in production systems today."
+)
+
+
+def _fake_paragraphs(topic: str, words: int) -> list[str]:
+    return [_FILLER.format(topic=topic)] * max(1, round(words / len(_FILLER.split())))
+
+
+def _fake_doc_spec(topic: str, target_words: int, asset_ids: list[str]) -> dict:
+    n_sections = max(3, min(8, target_words // 250))
+    sections = []
+    for i in range(n_sections):
+        sections.append(
+            {
+                "heading": f"{topic}: part {i + 1}",
+                "paragraphs": _fake_paragraphs(topic, target_words // n_sections),
+                "images": [{"asset_id": asset_ids[i], "caption": f"Figure {i + 1}"}] if i < min(2, len(asset_ids)) else [],
+            }
+        )
+    return {
+        "title": topic,
+        "subtitle": f"A practical guide to {topic}",
+        "sections": sections,
+        "references": [{"title": "Example reference", "url": "https://example.com"}],
+    }
+
+
+def fake_reply(prompt: str) -> str:
+    """Deterministic completion for a prompt, shaped like what the real model returns."""
+    m_topic = re.search(r"^Topic:\s*(.+)$", prompt, re.M) or re.search(r'"title":\s*"([^"]+)"', prompt)
+    topic = m_topic.group(1).strip() if m_topic else "Untitled"
+    m_words = re.search(r"~(\d+) words?", prompt)
+    target = int(m_words.group(1)) if m_words else 400
+    asset_ids = list(dict.fromkeys(re.findall(r'"asset_id":\s*"(img_[0-9a-f]+)"', prompt)))
+    if "Plan the outline" in prompt:
+        spec = _fake_doc_spec(topic, target, asset_ids)
+        n = len(spec["sections"])
+        return json.dumps(
+            {
+                "title": spec["title"],
+                "subtitle": spec["subtitle"],
+                "sections": [
+                    {"heading": s["heading"], "words": target // n, "points": ["what", "why", "how"],
+                     "images": [im["asset_id"] for im in s["images"]]}
+                    for s in spec["sections"]
+                ],
+            }
+        )
+    if "fill the word gaps" in prompt:
+        gaps = json.loads(prompt.rsplit("Gaps (", 1)[1].split("\n", 1)[1].split("\n", 1)[0])
+        return json.dumps({"additions": [{"section": g["section"], "paragraphs": _fake_paragraphs(topic, g["add_words"])} for g in gaps]})
+    m_heading = re.search(r"^Heading:\s*(.+)$", prompt, re.M)
+    if m_heading:
+        images = re.findall(r'"(img_[0-9a-f]+)"', prompt.split("Images (", 1)[-1])
+        return json.dumps(
+            {
+                "heading": m_heading.group(1).strip(),
+                "paragraphs": _fake_paragraphs(topic, target),
+                "images": [{"asset_id": a, "caption": "Figure"} for a in images],
+            }
+        )
+    spec = json.dumps(_fake_doc_spec(topic, target, asset_ids), ensure_ascii=False)
+    if "Final Answer:" in prompt:
+        return f"Final Answer: {spec}"
+    return spec
+
+
+class LocalChatModel(BaseChatModel):
+    """Offline chat model for tests and benchmarks (LLM_PROVIDER=fake).
+
+    Replies are a pure function of the prompt (reply_fn, default fake_reply),
+    so runs are reproducible and go through the same response cache as the
+    real model. latency_s and tokens_per_s simulate time-to-first-token and
+    generation speed.
+    """
+
+    model_name: str = "local-fake"
+    max_tokens: int = 1024
+    latency_s: float = 0.0
+    tokens_per_s: float = 0.0
+    reply_fn: Optional[Callable[[str], str]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-fake"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"model_name": self.model_name, "max_tokens": self.max_tokens}
+
+    def _reply(self, messages: list[BaseMessage]) -> tuple[ChatResult, float]:
+        prompt = "\n".join(str(m.content) for m in messages)
+        reply = (self.reply_fn or fake_reply)(prompt)
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(reply) // 4}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        delay = self.latency_s + (usage["output_tokens"] / self.tokens_per_s if self.tokens_per_s > 0 else 0.0)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply, usage_metadata=usage))]), delay
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        result, delay = self._reply(messages)
+        if delay:
+            time.sleep(delay)
+        return result
+
+    async def _agenerate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        result, delay = self._reply(messages)
+        if delay:
+            await asyncio.sleep(delay)
+        return result
+
+    def _deltas(self, messages: list[BaseMessage]) -> tuple[list[str], float, float]:
+        result, _ = self._reply(messages)
+        text = result.generations[0].text
+        deltas = [text[i : i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+        per_delta = STREAM_CHUNK_CHARS / 4 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+        return deltas, self.latency_s, per_delta
+
+    def _stream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any):
+        deltas, first, per_delta = self._deltas(messages)
+        if first:
+            time.sleep(first)
+        for d in deltas:
+            if per_delta:
+                time.sleep(per_delta)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=d))
+
+    async def _astream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any):
+        deltas, first, per_delta = self._deltas(messages)
+        if first:
+            await asyncio.sleep(first)
+        for d in deltas:
+            if per_delta:
+                await asyncio.sleep(per_delta)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=d))
+
+
+# Benchmarks can swap the fake's replies without touching call sites
+FAKE_REPLY_FN: Optional[Callable[[str], str]] = None
+
+
+@functools.lru_cache(maxsize=128)
+def _build_model(
+    provider: str, model: str, max_tokens: int, timeout_s: float, cache: Optional[BaseCache],
+    limiter: Optional[InMemoryRateLimiter], reply_fn: Optional[Callable[[str], str]],
+    loop: Optional[asyncio.AbstractEventLoop],
+) -> BaseChatModel:
+    if provider == "fake":
+        return LocalChatModel(
+            model_name=model,
+            max_tokens=max_tokens,
+            latency_s=float(os.getenv("FAKE_LLM_LATENCY_S", "0")),
+            tokens_per_s=float(os.getenv("FAKE_LLM_TOKENS_PER_S", "0")),
+            reply_fn=reply_fn,
+            cache=cache, rate_limiter=limiter, callbacks=[LLM_TELEMETRY],
+        )
+
+    from langchain_groq import ChatGroq
+
+    # The resilient wrapper enforces its own (adaptive) timeout and retries; this is only the ceiling,
+    # and bounds how long a call the wrapper gave up on keeps its pool thread
+    return ChatGroq(
+        model=model, temperature=0, max_tokens=max_tokens, timeout=timeout_s, max_retries=0,
+        cache=cache, rate_limiter=limiter, callbacks=[LLM_TELEMETRY],
+    )
+
+
+def chat_model(max_tokens: int, model: Optional[str] = None, timeout_s: Optional[float] = None) -> ResilientChatModel:
+    """Chat model for one LLM call site; temperature 0 so responses are cacheable.
+
+    model defaults to the large model (GROQ_MODEL). Calls go through ResilientChatModel (adaptive
+    timeout capped at timeout_s, jittered retries, hedging, circuit breaker) with GROQ_FALLBACK_MODEL
+    as the secondary model when set. Underlying instances (and so their HTTP connection pools) are
+    reused per model and max_tokens; async callers get one per event loop, because the async client
+    cannot outlive the loop it was used on.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    provider = os.getenv("LLM_PROVIDER", "groq").lower()
+    primary = model or _sized_model("large")
+    fallback = os.getenv("GROQ_FALLBACK_MODEL") or None
+
+    def build(model: str) -> tuple[str, BaseChatModel]:
+        return model, _build_model(
+            provider, model, max_tokens, timeout_s or LLM_TIMEOUT_S, LLM_CACHE, GROQ_LIMITER, FAKE_REPLY_FN, loop
+        )
+
+    return ResilientChatModel(
+        build(primary), build(fallback) if fallback and fallback != primary else None, max_tokens, timeout_s
+    )
+
+
+# Stage -> (model, max_tokens, timeout_s). Tool selection only chooses between two tools, so it runs
+# on the small model with a short deadline; spec writing and expansion keep the large one. Each is
+# overridable with LLM_<STAGE>_MODEL ("small", "large" or a model name), _MAX_TOKENS and _TIMEOUT_S.
+STAGES = {
+    "react": ("small", 600, 20.0),
+    "final": ("large", 1200, LLM_TIMEOUT_S),
+    "expand": ("large", 2000, LLM_TIMEOUT_S),
+}
+
+
+def _sized_model(size: str) -> str:
+    fake = os.getenv("LLM_PROVIDER", "groq").lower() == "fake"
+    if size == "small":
+        return "local-fake-small" if fake else os.getenv("GROQ_SMALL_MODEL", "llama-3.1-8b-instant")
+    if size == "large":
+        return "local-fake" if fake else os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+    return size
+
+
+def stage_route(stage: str) -> tuple[str, int, float]:
+    """(model, max_tokens, timeout_s) for a pipeline stage, env overrides applied."""
+    model, max_tokens, timeout_s = STAGES[stage]
+    env = f"LLM_{stage.upper()}"
+    return (
+        _sized_model(os.getenv(f"{env}_MODEL", model)),
+        int(os.getenv(f"{env}_MAX_TOKENS", str(max_tokens))),
+        float(os.getenv(f"{env}_TIMEOUT_S", str(timeout_s))),
+    )
+
+
+def stage_models(stage: str, max_tokens: Optional[int] = None) -> list[ResilientChatModel]:
+    """The stage's routed model, then the large model to escalate to when the first reply does not parse.
+
+    max_tokens overrides the stage's cap (call sites that size the output themselves).
+    """
+    model, cap, timeout_s = stage_route(stage)
+    max_tokens = max_tokens or cap
+    models = [chat_model(max_tokens, model, timeout_s)]
+    large = _sized_model("large")
+    if model != large:
+        models.append(chat_model(max_tokens, large))
+    return models
+
+
+def llm_latency_stats() -> dict:
+    return latency_stats()
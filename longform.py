@@ -0,0 +1,211 @@
+# longform.py
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from llm import stage_models
+from nodes import _is_valid_doc_spec
+from stream_json import extract_json_object
+from telemetry import bind, traced
+
+OUTLINE_MAX_TOKENS = 800
+SECTION_MAX_TOKENS = 2000
+MAX_SECTIONS = 8
+
+
+def _outline_prompt(topic: str, target_words: int, draft: dict, assets_brief: list[dict]) -> str:
+    return f"""
+Return ONLY valid JSON (no markdown). Plan the outline of a ~{target_words} word blog post.
+
+Schema:
+{{
+  "title": "string",
+  "subtitle": "string",
+  "sections": [{{"heading":"string","words":0,"points":["string"],"images":["asset_id"]}}]
+}}
+
+Rules:
+- 4–{MAX_SECTIONS} sections; "words" is the section's word budget, budgets sum to ~{target_words}.
+- 3–6 concrete "points" per section, grounded in the draft below (facts, numbers, names).
+- Put each available asset_id in at most one section, at most 2 overall:
+{json.dumps(assets_brief, ensure_ascii=False)}
+
+Topic: {topic}
+
+Draft to plan from:
+{json.dumps(draft, ensure_ascii=False)}
+"""
+
+
+def _section_prompt(topic: str, outline: dict, idx: int) -> str:
+    sec = outline["sections"][idx]
+    headings = [s["heading"] for s in outline["sections"]]
+    return f"""
+Return ONLY valid JSON (no markdown). Write section {idx + 1} of {len(headings)} of the blog "{outline['title']}".
+
+Schema:
+{{"heading":"string","paragraphs":["string"],"images":[{{"asset_id":"string","caption":"string"}}]}}
+
+Topic: {topic}
+All sections (write only yours, do not repeat the others): {json.dumps(headings, ensure_ascii=False)}
+Heading: {sec['heading']}
+Length: ~{sec['words']} words, in paragraphs of ~60–110 words.
+Cover these points: {json.dumps(sec.get('points', []), ensure_ascii=False)}
+Images (use EXACT asset_id, write a caption; [] if none): {json.dumps(sec.get('images', []), ensure_ascii=False)}
+"""
+
+
+def _budget(words) -> Optional[int]:
+    """A section's word budget as the model wrote it (300, 300.0, "about 300"), or None."""
+    if isinstance(words, (int, float)) and not isinstance(words, bool):
+        return int(words) if words > 0 else None
+    m = re.search(r"\d+", str(words or ""))
+    return (int(m.group()) or None) if m else None
+
+
+def _image_id(im) -> Optional[str]:
+    # The outline asks for ids; some replies give {"asset_id": ...} objects instead
+    if isinstance(im, dict):
+        im = im.get("asset_id")
+    return im if isinstance(im, str) else None
+
+
+def _parse_outline(text: str, target_words: int, draft: dict, asset_ids: set[str]) -> Optional[dict]:
+    try:
+        d = json.loads(extract_json_object(text) or text)
+    except Exception:
+        return None
+    if not isinstance(d, dict) or not isinstance(d.get("sections"), list):
+        return None
+    secs = [s for s in d["sections"] if isinstance(s, dict) and str(s.get("heading", "")).strip()]
+    if not secs:
+        return None
+    secs = secs[:MAX_SECTIONS]
+
+    # Rescale the model's budgets so they add up to the target by construction;
+    # a section without a usable budget gets an even share
+    parsed = [_budget(s.get("words")) for s in secs]
+    known = [b for b in parsed if b]
+    even = sum(known) / len(known) if known else 1
+    budgets = [b or even for b in parsed]
+    scale = target_words / sum(budgets)
+    used: set[str] = set()
+    for s, b in zip(secs, budgets):
+        s["words"] = max(60, round(b * scale))
+        images = s.get("images") if isinstance(s.get("images"), list) else []
+        ids = [a for a in map(_image_id, images) if a in asset_ids and a not in used]
+        used.update(ids)
+        s["images"] = ids
+
+    return {
+        "title": str(d.get("title") or draft.get("title") or ""),
+        "subtitle": str(d.get("subtitle") or draft.get("subtitle") or ""),
+        "sections": secs,
+    }
+
+
+def _parse_section(text: str, plan: dict) -> Optional[dict]:
+    try:
+        d = json.loads(extract_json_object(text) or text)
+    except Exception:
+        return None
+    if not isinstance(d, dict) or not isinstance(d.get("paragraphs"), list):
+        return None  # a bare string would otherwise become one paragraph per character
+    pars = [str(p) for p in d["paragraphs"] if isinstance(p, str) and p.strip()]
+    if not pars:
+        return None
+    allowed = set(plan.get("images", []))
+    images = [im for im in (d.get("images") or []) if isinstance(im, dict) and im.get("asset_id") in allowed]
+    return {"heading": plan["heading"], "paragraphs": pars, "images": images}
+
+
+def _assemble(outline: dict, written: list[Optional[dict]], draft: dict) -> dict:
+    draft_secs = draft.get("sections") or []
+    sections = []
+    for i, sec in enumerate(written):
+        if sec is None and i < len(draft_secs):
+            sec = draft_secs[i]  # a failed section falls back to the draft's, not to nothing
+        if sec is not None:
+            sections.append(sec)
+    d = {
+        "title": outline["title"],
+        "subtitle": outline["subtitle"],
+        "sections": sections,
+        "references": draft.get("references", []),
+    }
+    return d if _is_valid_doc_spec(d) else draft
+
+
+def _section_tokens(words: int) -> int:
+    return min(SECTION_MAX_TOKENS, int(words * 1.6) + 200)
+
+
+@traced("longform")
+def write_longform(topic: str, target_words: int, draft: dict, assets_brief: list[dict]) -> dict:
+    """Outline once, then write every section concurrently and assemble a doc_spec.
+
+    A reply that does not parse is asked of the large model when the stage is routed to another one.
+    """
+    asset_ids = {a["asset_id"] for a in assets_brief}
+    prompt = _outline_prompt(topic, target_words, draft, assets_brief)
+    outline = None
+    for model in stage_models("expand", OUTLINE_MAX_TOKENS):
+        text = str(model.invoke(prompt).content)
+        try:
+            outline = _parse_outline(text, target_words, draft, asset_ids)
+        except Exception:  # an odd reply moves on to the next model, it never loses the run
+            continue
+        if outline is not None:
+            break
+    if outline is None:
+        return draft
+
+    def write(idx: int) -> Optional[dict]:
+        plan = outline["sections"][idx]
+        for model in stage_models("expand", _section_tokens(plan["words"])):
+            try:
+                sec = _parse_section(str(model.invoke(_section_prompt(topic, outline, idx)).content), plan)
+            except Exception:
+                continue
+            if sec is not None:
+                return sec
+        return None
+
+    with ThreadPoolExecutor(max_workers=len(outline["sections"]), thread_name_prefix="section") as pool:
+        written = list(pool.map(bind(write), range(len(outline["sections"]))))
+    return _assemble(outline, written, draft)
+
+
+@traced("longform")
+async def awrite_longform(topic: str, target_words: int, draft: dict, assets_brief: list[dict]) -> dict:
+    asset_ids = {a["asset_id"] for a in assets_brief}
+    prompt = _outline_prompt(topic, target_words, draft, assets_brief)
+    outline = None
+    for model in stage_models("expand", OUTLINE_MAX_TOKENS):
+        text = str((await model.ainvoke(prompt)).content)
+        try:
+            outline = _parse_outline(text, target_words, draft, asset_ids)
+        except Exception:
+            continue
+        if outline is not None:
+            break
+    if outline is None:
+        return draft
+
+    async def write(idx: int) -> Optional[dict]:
+        plan = outline["sections"][idx]
+        for model in stage_models("expand", _section_tokens(plan["words"])):
+            try:
+                sec = _parse_section(str((await model.ainvoke(_section_prompt(topic, outline, idx))).content), plan)
+            except Exception:
+                continue
+            if sec is not None:
+                return sec
+        return None
+
+    written = await asyncio.gather(*(write(i) for i in range(len(outline["sections"]))))
+    return _assemble(outline, list(written), draft)
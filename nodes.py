@@ -1,36 +1,51 @@
 from __future__ import annotations
 
+import asyncio
 import json
-import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 from langchain_core.agents import AgentAction, AgentFinish
-from langchain_groq import ChatGroq
-
-from state import AgentState
-from tools import TOOLS, fetch_image
-
-MAX_TOTAL_TOOL_STEPS = 6
-MAX_STEPS_IN_CONTEXT = 3
+from langchain_core.runnables import RunnableConfig
+
+from image_pipeline import near_duplicate
+from llm import stage_models, stage_route
+from prompt_budget import ASSETS_BUDGET, STEPS_BUDGET, assets_block, count_tokens, scratchpad
+from state import MAX_STEPS_IN_CONTEXT, AgentState, Step
+from step_store import observation_text, record_step
+from stream_json import ObjectStream, OffSchema, extract_json_object
+from telemetry import bind, span, traced
+from tools import TOOLS, aselect_images, select_images
+
+MAX_TOTAL_TOOL_STEPS = 6  # tool calls the model asked for (a search's auto-downloaded images are part of it)
 MAX_IMAGES = 2
+MAX_ACTIONS_PER_TURN = 3  # independent tool calls from one reply run side by side in act_node
+MAX_IMAGE_CANDIDATES = 6  # probed and compared before the best MAX_IMAGES distinct ones are downloaded
+# Observations go to the step store whole (compacted per prompt by prompt_budget); this only guards against huge pages
+MAX_OBS_CHARS = 8000
 
 
-def _truncate(s: str, n: int = 1200) -> str:
+def _truncate(s: str, n: int = MAX_OBS_CHARS) -> str:
     s = str(s)
     return s if len(s) <= n else s[:n] + "...[truncated]"
 
 
-def _scratchpad(steps: list[tuple[AgentAction, str]]) -> str:
-    recent = steps[-MAX_STEPS_IN_CONTEXT:] if steps else []
-    blocks = []
-    for a, obs in recent:
-        blocks.append(
-            f"Action: {a.tool}\n"
-            f"Action Input: {json.dumps(a.tool_input, ensure_ascii=False)}\n"
-            f"Observation: {_truncate(obs)}"
-        )
-    return "\n\n".join(blocks) if blocks else "(none)"
+def _scratchpad(steps: list[Step]) -> str:
+    recent = steps[-MAX_STEPS_IN_CONTEXT:]
+    return scratchpad([(s, observation_text(s)) for s in recent], MAX_STEPS_IN_CONTEXT, STEPS_BUDGET)
+
+
+def _assets_brief(state: AgentState) -> str:
+    return assets_block(state.get("assets", []), ASSETS_BUDGET)
+
+
+def _measured(kind: str, prompt: str) -> str:
+    """Record the assembled prompt size as a span so traces show it per call."""
+    with span(f"prompt.{kind}") as rec:
+        rec["prompt_tokens"] = count_tokens(prompt)
+        rec["chars"] = len(prompt)
+    return prompt
 
 
 def _is_valid_doc_spec(d: dict) -> bool:
@@ -44,32 +59,36 @@ def _is_valid_doc_spec(d: dict) -> bool:
         return False
     if not isinstance(d.get("references", []), list):
         return False
-    for s in d["sections"]:
-        if not isinstance(s, dict):
-            return False
-        if not isinstance(s.get("heading"), str):
-            return False
-        if not isinstance(s.get("paragraphs"), list) or not s["paragraphs"]:
-            return False
-        if not isinstance(s.get("images", []), list):
-            return False
-    return True
+    return all(_is_valid_section(s) for s in d["sections"])
+
+
+def _is_valid_section(s) -> bool:
+    return (
+        isinstance(s, dict)
+        and isinstance(s.get("heading"), str)
+        and isinstance(s.get("paragraphs"), list) and bool(s["paragraphs"])
+        and isinstance(s.get("images", []), list)
+    )
 
 
-def _extract_json_object(text: str) -> Optional[str]:
-    m = re.search(r"(\{[\s\S]*\})", text)
-    return m.group(1).strip() if m else None
+def _doc_spec_stream(on_section=None) -> ObjectStream:
+    """Incremental doc_spec parser: sections are checked (and handed to on_section) as they close."""
+    return ObjectStream({"title": '"', "sections": "[", "references": "["}, "sections", _is_valid_section, on_section)
 
 
-def _force_final_doc(state: AgentState) -> AgentFinish:
-    model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
-    llm = ChatGroq(model=model, temperature=0, max_tokens=1200, timeout=60, max_retries=0)
+def _section_sink(config: Optional[RunnableConfig], source: str):
+    """on_section callback reporting finished sections to the run's on_event listener, if any."""
+    on_event = ((config or {}).get("configurable") or {}).get("on_event")
+    if on_event is None:
+        return None
+    return lambda i, sec: on_event(
+        {"stage": "section", "source": source, "index": i, "heading": sec["heading"], "paragraphs": len(sec["paragraphs"])}
+    )
 
-    assets_brief = [
-        {"asset_id": a["asset_id"], "source_url": a["source_url"]} for a in state.get("assets", [])
-    ]
 
-    prompt = f"""
+def _final_doc_prompt(state: AgentState, draft: Optional[str] = None) -> str:
+    draft_block = f"\nDraft written while researching (keep what is right, correct and complete the rest):\n{draft}\n" if draft else ""
+    return _measured("final_doc", f"""
 Return ONLY valid JSON (no markdown). Must match schema exactly.
 
 Schema:
@@ -89,24 +108,29 @@ Schema:
 Topic: {state["topic"]}
 
 Available assets:
-{json.dumps(assets_brief, ensure_ascii=False)}
+{_assets_brief(state)}
 
 Recent tool observations:
 {_scratchpad(state.get("intermediate_steps", []))}
-
+{draft_block}
 Rules:
 - Minimum 3 sections.
 - If assets exist, reference up to 2 images using EXACT asset_id values above.
 - Add 3–6 references from the search results.
-"""
-    msg = llm.invoke(prompt).content
-    raw = _extract_json_object(str(msg)) or str(msg).strip()
+""")
+
+
+def _valid_doc_json(msg) -> Optional[str]:
+    raw = extract_json_object(str(msg)) or str(msg).strip()
     try:
-        d = json.loads(raw)
+        return raw if _is_valid_doc_spec(json.loads(raw)) else None
     except Exception:
-        d = {}
+        return None
+
 
-    if not _is_valid_doc_spec(d):
+def _final_doc_from_text(state: AgentState, msg: str) -> AgentFinish:
+    raw = _valid_doc_json(msg)
+    if raw is None:
         d = {
             "title": state["topic"],
             "subtitle": "",
@@ -124,7 +148,54 @@ Rules:
     return AgentFinish(return_values={"output": raw}, log=str(msg))
 
 
-def _parse_model_output_to_action_or_finish(text: str) -> AgentAction | AgentFinish:
+def _force_final_doc(
+    state: AgentState, config: Optional[RunnableConfig] = None, draft: Optional[str] = None
+) -> AgentFinish:
+    # Streamed: an off-schema reply is cut off at the first bad token instead of after 1200;
+    # a reply that does not parse is retried once on the large model when the stage routes elsewhere.
+    # draft: a spec the react model already wrote; kept if the final stage cannot do better
+    prompt = _final_doc_prompt(state, draft)
+    for model in stage_models("final"):
+        parser = _doc_spec_stream(_section_sink(config, "final_answer"))
+        with span("final_doc.stream", model=model.name) as rec:
+            try:
+                msg = model.stream(prompt, parser.feed)
+            except OffSchema as e:
+                rec["aborted"] = str(e)
+                msg = parser.result()
+            rec["sections"] = len(parser.items)
+        if _valid_doc_json(msg) is not None:
+            break
+    else:
+        msg = draft or msg
+    return _final_doc_from_text(state, msg)
+
+
+async def _aforce_final_doc(
+    state: AgentState, config: Optional[RunnableConfig] = None, draft: Optional[str] = None
+) -> AgentFinish:
+    prompt = _final_doc_prompt(state, draft)
+    for model in stage_models("final"):
+        parser = _doc_spec_stream(_section_sink(config, "final_answer"))
+        with span("final_doc.stream", model=model.name) as rec:
+            try:
+                msg = await model.astream(prompt, parser.feed)
+            except OffSchema as e:
+                rec["aborted"] = str(e)
+                msg = parser.result()
+            rec["sections"] = len(parser.items)
+        if _valid_doc_json(msg) is not None:
+            break
+    else:
+        msg = draft or msg
+    return _final_doc_from_text(state, msg)
+
+
+# One tool call: its input runs up to the next Action/Thought line or the end of the reply
+_ACTION = re.compile(r"Action:\s*(\w+)\s*[\r\n]+Action Input:\s*([\s\S]+?)(?=\n\s*(?:Action|Thought)\s*:|\Z)", re.I)
+
+
+def _parse_model_output_to_action_or_finish(text: str) -> AgentAction | list[AgentAction] | AgentFinish:
     t = text.strip()
 
     if t.startswith("{") and t.endswith("}"):
@@ -141,39 +212,26 @@ def _parse_model_output_to_action_or_finish(text: str) -> AgentAction | AgentFin
             raise ValueError("Final Answer JSON invalid doc_spec")
         return AgentFinish(return_values={"output": raw}, log=text)
 
-    m_act = re.search(r"Action:\s*(\w+)\s*[\r\n]+Action Input:\s*([\s\S]+)$", text, re.I)
-    if not m_act:
+    actions = []
+    for m in _ACTION.finditer(text):
+        tool_input_raw = m.group(2).strip()
+        try:
+            tool_input = json.loads(tool_input_raw)
+        except Exception:
+            tool_input = tool_input_raw
+        action = AgentAction(tool=m.group(1).strip(), tool_input=tool_input, log=m.group(0))
+        if all((a.tool, str(a.tool_input)) != (action.tool, str(action.tool_input)) for a in actions):
+            actions.append(action)
+    if not actions:
         raise ValueError(f"Could not parse model output:\n{text}")
 
-    tool = m_act.group(1).strip()
-    tool_input_raw = m_act.group(2).strip()
-
-    try:
-        tool_input = json.loads(tool_input_raw)
-    except Exception:
-        tool_input = tool_input_raw
-
-    return AgentAction(tool=tool, tool_input=tool_input, log=text)
+    return actions[0] if len(actions) == 1 else actions[:MAX_ACTIONS_PER_TURN]
 
 
-def reason_node(state: AgentState):
+def _react_prompt(state: AgentState) -> str:
     steps = state.get("intermediate_steps", [])
-    assets = state.get("assets", [])
 
-    # Bulletproof: bootstrap a search if nothing has happened yet
-    if not steps and not assets:
-        q = f"{state['topic']} diagram pipeline png"
-        return {"agent_outcome": AgentAction(tool="web_search", tool_input=q, log="bootstrap web_search")}
-
-    if len(steps) >= MAX_TOTAL_TOOL_STEPS:
-        return {"agent_outcome": _force_final_doc(state)}
-
-    model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
-    llm = ChatGroq(model=model, temperature=0, max_tokens=600, timeout=60, max_retries=0)
-
-    assets_brief = [{"asset_id": a["asset_id"], "source_url": a["source_url"]} for a in assets]
-
-    prompt = f"""
+    return _measured("react", f"""
 You are a minimal ReAct agent that produces a Word-blog JSON spec.
 
 Tools: [web_search, fetch_image]
@@ -182,6 +240,7 @@ Rules:
 - If no assets exist yet, call fetch_image for up to {MAX_IMAGES} image URLs seen in web_search observation.
 - Then output Final Answer as JSON matching the schema.
 - If assets exist, you MUST use EXACT asset_id values from "Available assets".
+- Independent calls (several searches, several images) can go in one reply: up to {MAX_ACTIONS_PER_TURN} Action / Action Input pairs, run in parallel.
 
 Tool call format:
 Action: web_search
@@ -196,25 +255,89 @@ Final Answer: {{...doc_spec json...}}
 Topic: {state["topic"]}
 
 Available assets:
-{json.dumps(assets_brief, ensure_ascii=False)}
+{_assets_brief(state)}
 
 Previous steps:
 {_scratchpad(steps)}
-"""
-    text = str(llm.invoke(prompt).content)
-    try:
-        outcome = _parse_model_output_to_action_or_finish(text)
+""")
+
+
+def _bootstrap_query(topic: str) -> str:
+    return f"{topic} diagram pipeline png"
+
+
+def _bootstrap_action(state: AgentState) -> Optional[AgentAction]:
+    # Bulletproof: bootstrap a search if nothing has happened yet
+    if not state.get("step_count") and not state.get("assets"):
+        q = _bootstrap_query(state["topic"])
+        return AgentAction(tool="web_search", tool_input=q, log="bootstrap web_search")
+    return None
+
+
+def _final_stage_rewrites(outcome, model) -> bool:
+    # A Final Answer from a model other than the final stage's (the small tool-selection one) only
+    # says research is done; the final stage writes the spec, with that answer as its draft
+    return isinstance(outcome, AgentFinish) and model.name != stage_route("final")[0]
+
+
+@traced("reason_node")
+def reason_node(state: AgentState, config: Optional[RunnableConfig] = None):
+    bootstrap = _bootstrap_action(state)
+    if bootstrap is not None:
+        return {"agent_outcome": bootstrap}
+
+    if state.get("step_count", 0) >= MAX_TOTAL_TOOL_STEPS:
+        return {"agent_outcome": _force_final_doc(state, config)}
+
+    # Tool selection runs on the small model; a reply that does not parse is asked of the large one
+    prompt = _react_prompt(state)
+    for model in stage_models("react"):
+        with span("react.turn", model=model.name) as rec:
+            text = str(model.invoke(prompt).content)
+            try:
+                outcome = _parse_model_output_to_action_or_finish(text)
+            except Exception as e:
+                rec["unparsed"] = str(e)[:200]
+                continue
+        if _final_stage_rewrites(outcome, model):
+            return {"agent_outcome": _force_final_doc(state, config, draft=outcome.return_values["output"])}
         return {"agent_outcome": outcome}
-    except Exception:
-        return {"agent_outcome": _force_final_doc(state)}
+    return {"agent_outcome": _force_final_doc(state, config)}
+
+
+@traced("reason_node")
+async def areason_node(state: AgentState, config: Optional[RunnableConfig] = None):
+    bootstrap = _bootstrap_action(state)
+    if bootstrap is not None:
+        return {"agent_outcome": bootstrap}
+
+    if state.get("step_count", 0) >= MAX_TOTAL_TOOL_STEPS:
+        return {"agent_outcome": await _aforce_final_doc(state, config)}
+
+    prompt = _react_prompt(state)
+    for model in stage_models("react"):
+        with span("react.turn", model=model.name) as rec:
+            text = str((await model.ainvoke(prompt)).content)
+            try:
+                outcome = _parse_model_output_to_action_or_finish(text)
+            except Exception as e:
+                rec["unparsed"] = str(e)[:200]
+                continue
+        if _final_stage_rewrites(outcome, model):
+            return {"agent_outcome": await _aforce_final_doc(state, config, draft=outcome.return_values["output"])}
+        return {"agent_outcome": outcome}
+    return {"agent_outcome": await _aforce_final_doc(state, config)}
 
 
-def act_node(state: AgentState):
+def _outcome_actions(state: AgentState) -> list[AgentAction]:
     outcome = state["agent_outcome"]
     if outcome is None or isinstance(outcome, AgentFinish):
-        return {}
+        return []
+    return list(outcome) if isinstance(outcome, list) else [outcome]
+
 
-    action: AgentAction = outcome
+def _resolve_action(action: AgentAction):
+    """Return (tool, normalized input), or a ready state update if there is nothing to run."""
     tool_name = action.tool
     tool_input = action.tool_input
 
@@ -233,45 +356,147 @@ def act_node(state: AgentState):
         else:
             tool_input = str(tool_input)
 
-    try:
-        raw_obs = tool.invoke(tool_input)
-        obs = _truncate(raw_obs)
-    except Exception as e:
-        return {"intermediate_steps": [(action, f"Tool '{tool_name}' failed: {e}")]}
+    return tool, tool_input
 
-    steps_update: list[tuple[AgentAction, str]] = [(action, obs)]
-    assets_update = []
 
-    # Auto-download top images right after web_search
-    if tool_name == "web_search":
-        try:
-            data = json.loads(raw_obs) if isinstance(raw_obs, str) else raw_obs
-            imgs = (data.get("images") or [])[:MAX_IMAGES]
-            downloaded = []
-
-            for im in imgs:
-                url = (im or {}).get("url")
-                if not url:
-                    continue
-                fa = AgentAction(tool="fetch_image", tool_input=url, log=f"auto fetch {url}")
-                asset_json = fetch_image.invoke(url)
-                asset = json.loads(asset_json)
-                assets_update.append(asset)
-                downloaded.append(asset["asset_id"])
-                steps_update.append((fa, f"downloaded {asset['asset_id']} from {url}"))
-
-            if downloaded:
-                steps_update[0] = (steps_update[0][0], steps_update[0][1] + f"\nDownloaded assets: {downloaded}")
+def _auto_fetch_urls(raw_obs) -> list[str]:
+    data = json.loads(raw_obs) if isinstance(raw_obs, str) else raw_obs
+    imgs = (data.get("images") or [])[:MAX_IMAGE_CANDIDATES]
+    urls = [(im or {}).get("url") for im in imgs]
+    return list(dict.fromkeys(u for u in urls if u))
 
-        except Exception as e:
-            steps_update[0] = (steps_update[0][0], steps_update[0][1] + f"\n(auto image download skipped: {e})")
+
+def _act_update(
+    action: AgentAction, raw_obs, fetched: list[tuple[str, dict | Exception]], skipped: Optional[list[str]] = None
+) -> dict:
+    obs = _truncate(raw_obs)
+    assets_update = []
+
+    # Images auto-downloaded after web_search are part of its observation, not steps of their own:
+    # the step window and budget count what the model asked for
+    downloaded, failed = [], []
+    for url, res in fetched:
+        if isinstance(res, Exception):
+            failed.append(f"{url}: {res}")
+            continue
+        assets_update.append(res)
+        downloaded.append(f"{res['asset_id']} from {url}")
+
+    if downloaded:
+        obs += f"\nDownloaded assets: {downloaded}"
+    if failed:
+        obs += f"\n(auto image download failed: {failed})"
+    if skipped:
+        obs += f"\n(images not used: {skipped})"
 
     # Register assets if tool was fetch_image
-    if tool_name == "fetch_image":
+    if action.tool == "fetch_image":
         try:
             asset = json.loads(raw_obs)
             assets_update.append(asset)
         except Exception:
             pass
 
-    return {"intermediate_steps": steps_update, "assets": assets_update}
+    return {"intermediate_steps": [(action, obs)], "assets": assets_update}
+
+
+def _prefetcher(config: Optional[RunnableConfig]):
+    """Speculative results for this run, if run() started a Prefetcher (see prefetch.py)."""
+    return ((config or {}).get("configurable") or {}).get("prefetcher")
+
+
+def _merge_updates(updates: list[dict]) -> dict:
+    """Per-action updates joined in the order the model listed the actions, as compact Step records.
+
+    Sibling searches select their images independently, so an image one of
+    them already contributed (same asset, or the same picture by dHash) is
+    dropped from the later ones.
+    """
+    steps, assets = [], []
+    for update in updates:
+        steps.extend(record_step(action, obs) for action, obs in update.get("intermediate_steps", []))
+        for asset in update.get("assets", []):
+            if not any(_same_image(asset, kept) for kept in assets):
+                assets.append(asset)
+    return {"intermediate_steps": steps, "step_count": len(steps), "assets": assets}
+
+
+def _same_image(a: dict, b: dict) -> bool:
+    return a.get("asset_id") == b.get("asset_id") or near_duplicate(a.get("dhash"), b.get("dhash"))
+
+
+def _act_one(state: AgentState, action: AgentAction, prefetcher) -> dict:
+    resolved = _resolve_action(action)
+    if isinstance(resolved, dict):
+        return resolved
+    tool, tool_input = resolved
+
+    try:
+        with span(f"tool.{tool.name}"):
+            raw_obs = prefetcher.call(tool, tool_input) if prefetcher else tool.invoke(tool_input)
+    except Exception as e:
+        return {"intermediate_steps": [(action, f"Tool '{tool.name}' failed: {e}")]}
+
+    fetched, skipped = [], []
+    if tool.name == "web_search":
+        try:
+            urls = _auto_fetch_urls(raw_obs)
+            # Probed in parallel, best distinct images downloaded under one deadline (see tools.select_images)
+            select = prefetcher.select_images if prefetcher else select_images
+            fetched, skipped = select(urls, MAX_IMAGES, state.get("assets", []))
+        except Exception as e:
+            return {"intermediate_steps": [(action, _truncate(raw_obs) + f"\n(auto image download skipped: {e})")]}
+
+    return _act_update(action, raw_obs, fetched, skipped)
+
+
+async def _aact_one(state: AgentState, action: AgentAction, prefetcher) -> dict:
+    resolved = _resolve_action(action)
+    if isinstance(resolved, dict):
+        return resolved
+    tool, tool_input = resolved
+
+    try:
+        with span(f"tool.{tool.name}"):
+            raw_obs = await (prefetcher.acall(tool, tool_input) if prefetcher else tool.ainvoke(tool_input))
+    except Exception as e:
+        return {"intermediate_steps": [(action, f"Tool '{tool.name}' failed: {e}")]}
+
+    fetched, skipped = [], []
+    if tool.name == "web_search":
+        try:
+            urls = _auto_fetch_urls(raw_obs)
+            aselect = prefetcher.aselect_images if prefetcher else aselect_images
+            fetched, skipped = await aselect(urls, MAX_IMAGES, state.get("assets", []))
+        except Exception as e:
+            return {"intermediate_steps": [(action, _truncate(raw_obs) + f"\n(auto image download skipped: {e})")]}
+
+    return _act_update(action, raw_obs, fetched, skipped)
+
+
+@traced("act_node")
+def act_node(state: AgentState, config: Optional[RunnableConfig] = None):
+    actions = _outcome_actions(state)
+    if not actions:
+        return {}
+    prefetcher = _prefetcher(config)
+    if len(actions) == 1:
+        return _merge_updates([_act_one(state, actions[0], prefetcher)])
+
+    # Independent calls from one reply: run side by side, merge in the order they were asked for
+    with ThreadPoolExecutor(max_workers=len(actions), thread_name_prefix="action") as pool:
+        updates = list(pool.map(bind(lambda a: _act_one(state, a, prefetcher)), actions))
+    return _merge_updates(updates)
+
+
+@traced("act_node")
+async def aact_node(state: AgentState, config: Optional[RunnableConfig] = None):
+    actions = _outcome_actions(state)
+    if not actions:
+        return {}
+    prefetcher = _prefetcher(config)
+    if len(actions) == 1:
+        return _merge_updates([await _aact_one(state, actions[0], prefetcher)])
+
+    updates = await asyncio.gather(*(_aact_one(state, a, prefetcher) for a in actions))
+    return _merge_updates(list(updates))
@@ -0,0 +1,116 @@
+# prefetch.py
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Optional
+
+import tools
+from nodes import _auto_fetch_urls, _bootstrap_query
+from search_cache import normalize_query
+from telemetry import bind, span
+
+SPECULATIVE_QUERIES = int(os.getenv("SPECULATIVE_QUERIES", "2"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "6"))
+
+# Follow-ups the model asks for most often after the bootstrap search
+_FOLLOW_UPS = ("{topic} explained", "{topic} architecture diagram", "{topic} best practices")
+
+
+def speculative_queries(topic: str, n: int = SPECULATIVE_QUERIES) -> list[str]:
+    return [_bootstrap_query(topic)] + [f.format(topic=topic) for f in _FOLLOW_UPS[: max(0, n)]]
+
+
+class Prefetcher:
+    """Runs likely tool calls ahead of the agent for one run.
+
+    Searches (and the probes of their candidate images) start as soon as the
+    Prefetcher is created, so they overlap the first LLM turns. act_node asks
+    call()/select_images() first: an action that matches a speculative query,
+    or a candidate image already probed, waits on that in-flight work instead
+    of starting a new round trip. Anything that fails speculatively is simply
+    run again for real.
+    """
+
+    def __init__(self, topic: str, queries: Optional[list[str]] = None):
+        self._pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._searches: dict[str, Future] = {}
+        self._probes: dict[str, Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self._t0 = time.perf_counter()
+        for q in queries if queries is not None else speculative_queries(topic):
+            self._searches[normalize_query(q)] = self._pool.submit(bind(self._search), q)
+
+    def _search(self, query: str) -> str:
+        with span("prefetch.web_search", query=query):
+            obs = tools.web_search.invoke(query)
+        self._probe_futures(_auto_fetch_urls(obs))
+        return obs
+
+    def _probe_futures(self, urls: list[str]) -> list[Future]:
+        with self._lock:
+            for url in urls:
+                if url not in self._probes:
+                    self._probes[url] = self._pool.submit(bind(tools.probe_image), url)
+            return [self._probes[url] for url in urls]
+
+    def _match(self, tool_name: str, tool_input: Any) -> Optional[Future]:
+        # fetch_image is not matched: whatever select_images downloaded is in the asset store already
+        with self._lock:
+            if tool_name == "web_search":
+                fut = self._searches.get(normalize_query(tool_input))
+            else:
+                return None
+            if fut is None or fut.cancelled():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return fut
+
+    def call(self, tool, tool_input: Any) -> Any:
+        fut = self._match(tool.name, tool_input)
+        if fut is not None:
+            try:
+                return fut.result()
+            except Exception:
+                pass
+        return tool.invoke(tool_input)
+
+    async def acall(self, tool, tool_input: Any) -> Any:
+        fut = self._match(tool.name, tool_input)
+        if fut is not None:
+            try:
+                return await asyncio.wrap_future(fut)
+            except Exception:
+                pass
+        return await tool.ainvoke(tool_input)
+
+    def select_images(self, urls: list[str], limit: int, have: Optional[list[dict]] = None) -> tuple[list, list[str]]:
+        """tools.select_images, reusing probes that are already running or done."""
+        return tools.select_images(urls, limit, have, probes=self._probe_futures(urls))
+
+    async def aselect_images(self, urls: list[str], limit: int, have: Optional[list[dict]] = None) -> tuple[list, list[str]]:
+        return await tools.aselect_images(urls, limit, have, probes=self._probe_futures(urls))
+
+    def stats(self) -> dict:
+        with self._lock:
+            futures = list(self._searches.values()) + list(self._probes.values())
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "searches": len(self._searches),
+                "probes": len(self._probes),
+                "pending": sum(not f.done() for f in futures),
+            }
+
+    def close(self) -> None:
+        """Drop speculative work nobody asked for; already running calls finish in the background."""
+        stats = self.stats()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        with span("prefetch", **stats) as rec:
+            rec["seconds_alive"] = round(time.perf_counter() - self._t0, 3)
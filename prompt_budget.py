@@ -0,0 +1,150 @@
+# prompt_budget.py
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Optional
+
+from dedup import NearDuplicates
+
+try:  # optional: exact counts when tiktoken is installed, otherwise ~4 chars/token
+    import tiktoken
+
+    _ENC = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENC = None
+
+# Token budgets per prompt piece
+STEPS_BUDGET = int(os.getenv("PROMPT_STEPS_TOKENS", "700"))
+ASSETS_BUDGET = int(os.getenv("PROMPT_ASSETS_TOKENS", "150"))
+RESULT_MIN_TOKENS = 15
+IMAGE_DESC_WORDS = 8
+
+
+def count_tokens(text: str) -> int:
+    if _ENC is not None:
+        return len(_ENC.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def fit_tokens(text: str, budget: int) -> str:
+    """Cut text to about budget tokens, at a sentence end when one is near, else at a word."""
+    text = " ".join(str(text).split())
+    if count_tokens(text) <= budget:
+        return text
+    if budget <= 0:
+        return ""
+    approx = text[: budget * 4]
+    while approx and count_tokens(approx) > budget:
+        approx = approx[: int(len(approx) * 0.9)]
+    cut = max(approx.rfind(". "), approx.rfind("! "), approx.rfind("? "))
+    if cut >= len(approx) * 0.6:
+        return approx[: cut + 1]
+    return approx.rsplit(" ", 1)[0] + " …"
+
+
+def _split_observation(obs: str) -> tuple[Any, str]:
+    """Leading JSON payload (if any) and the trailing notes act_node appends to it."""
+    s = str(obs).lstrip()
+    if s.startswith("{"):
+        try:
+            data, end = json.JSONDecoder().raw_decode(s)
+            return data, s[end:].strip()
+        except ValueError:
+            pass
+    return None, s
+
+
+def compact_search(data: dict, budget: int, seen: Optional[NearDuplicates] = None) -> str:
+    """Render a web_search payload field by field: every result keeps its title and url, content shares the rest.
+
+    With seen (shared across the steps of one prompt), a page already shown is reduced to a pointer
+    to that copy and its share of the budget goes to the pages that are new.
+    """
+    query = data.get("query", "")
+    head = f'Search "{query}"'
+    results = [r for r in data.get("results") or [] if isinstance(r, dict)]
+    images = [im for im in data.get("images") or [] if isinstance(im, dict) and im.get("url")]
+    seen = seen if seen is not None else NearDuplicates()
+
+    img_lines = []
+    for im in images:
+        if seen.find(im["url"], "") is not None:
+            continue
+        seen.add("", im["url"], "")
+        desc = " ".join(str(im.get("description") or "").split()[:IMAGE_DESC_WORDS])
+        img_lines.append(f"- {im['url']}" + (f" ({desc})" if desc else ""))
+    img_block = ("Images:\n" + "\n".join(img_lines)) if img_lines else ""
+
+    fixed, fresh = [], []
+    for i, r in enumerate(results):
+        line = f"[{i + 1}] {r.get('title') or ''} — {r.get('url') or ''}"
+        text = f"{r.get('title') or ''} {r.get('content') or ''}"
+        repeats = seen.find(r.get("url") or "", text)
+        if repeats is None:
+            seen.add(f'[{i + 1}] of "{query}"', r.get("url") or "", text)
+        else:
+            line += f" (same as {repeats})"
+        fixed.append(line)
+        fresh.append(repeats is None)
+    spare = budget - count_tokens("\n".join([head, img_block, *fixed]))
+    per_result = max(RESULT_MIN_TOKENS, spare // max(1, sum(fresh)))
+
+    lines = [head]
+    for line, r, new in zip(fixed, results, fresh):
+        lines.append(line)
+        content = fit_tokens(r.get("content") or "", per_result) if new else ""
+        if content:
+            lines.append(f"    {content}")
+    if img_block:
+        lines.append(img_block)
+    return "\n".join(lines)
+
+
+def compact_observation(obs: str, budget: int, seen: Optional[NearDuplicates] = None) -> str:
+    data, notes = _split_observation(obs)
+    if isinstance(data, dict) and "results" in data:
+        body = compact_search(data, budget - count_tokens(notes), seen)
+        return f"{body}\n{notes}" if notes else body
+    if data is not None:
+        return fit_tokens(json.dumps(data, ensure_ascii=False, separators=(",", ":")), budget)
+    return fit_tokens(notes, budget)
+
+
+def _action_line(tool: str, tool_input: Any) -> str:
+    return f"Action: {tool}\nAction Input: {json.dumps(tool_input, ensure_ascii=False)}"
+
+
+def scratchpad(steps: list, max_steps: int, budget: int = STEPS_BUDGET) -> str:
+    """Most recent steps first in priority; each gets an even share, leftovers roll over to older ones.
+
+    Pages an older step repeats from a newer one (same url or near-duplicate text) are not paid for twice.
+    """
+    recent = steps[-max_steps:] if steps else []
+    if not recent:
+        return "(none)"
+    blocks: list[str] = []
+    remaining = budget
+    seen = NearDuplicates()
+    for i, (action, obs) in enumerate(reversed(recent)):
+        share = remaining // (len(recent) - i)
+        head = _action_line(action.tool, action.tool_input)
+        body = compact_observation(obs, max(0, share - count_tokens(head) - 2), seen)
+        block = f"{head}\nObservation: {body}"
+        remaining -= count_tokens(block)
+        blocks.append(block)
+    return "\n\n".join(reversed(blocks))
+
+
+def assets_block(assets: list[dict], budget: int = ASSETS_BUDGET) -> str:
+    """JSON list of {asset_id, source_url}; the ids are what the model must copy exactly, so never cut one in half."""
+    out: list[dict] = []
+    for a in assets:
+        entry = {"asset_id": a["asset_id"], "source_url": a["source_url"]}
+        if count_tokens(json.dumps(out + [entry], ensure_ascii=False)) > budget:
+            entry = {"asset_id": a["asset_id"]}
+            if count_tokens(json.dumps(out + [entry], ensure_ascii=False)) > budget:
+                break
+        out.append(entry)
+    return json.dumps(out, ensure_ascii=False)
+
@@ -1,14 +1,33 @@
 from __future__ import annotations
 
+import copy
 import os
-from typing import Any, Dict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from typing import IO, Any, Dict, Union
 
 from docx import Document
 from docx.shared import Inches
 
+from image_pipeline import DISPLAY_WIDTH_IN, near_duplicate
 
-def render_docx(doc_spec: Dict[str, Any], assets_by_id: Dict[str, dict], out_path: str) -> None:
-    doc = Document()
+
+@lru_cache(maxsize=1)
+def _base_template():
+    # Parsing the default template package is most of an empty render; do it once per process
+    return Document()
+
+
+def _embedded_media(doc) -> list[str]:
+    return sorted(
+        str(p.partname).lstrip("/") for p in doc.part.package.iter_parts() if str(p.partname).startswith("/word/media/")
+    )
+
+
+def render_docx(doc_spec: Dict[str, Any], assets_by_id: Dict[str, dict], out: Union[str, IO[bytes]]) -> list[str]:
+    """Render doc_spec to a path or a binary stream; returns the embedded media part names."""
+    doc = copy.deepcopy(_base_template())
 
     doc.add_heading(doc_spec.get("title", "Untitled"), level=0)
     subtitle = doc_spec.get("subtitle", "")
@@ -16,6 +35,11 @@ def render_docx(doc_spec: Dict[str, Any], assets_by_id: Dict[str, dict], out_pat
         doc.add_paragraph(subtitle)
 
     inserted_images = 0
+    embedded: list[dict] = []
+
+    def is_repeat(asset: dict) -> bool:
+        # The same picture under another asset_id (another URL or size) adds nothing but bytes
+        return any(a is asset or near_duplicate(a.get("dhash"), asset.get("dhash")) for a in embedded)
 
     for section in doc_spec.get("sections", []):
         doc.add_heading(section.get("heading", ""), level=1)
@@ -31,10 +55,11 @@ def render_docx(doc_spec: Dict[str, Any], assets_by_id: Dict[str, dict], out_pat
                 continue
 
             path = asset.get("path")
-            if not path or not os.path.exists(path):
+            if not path or not os.path.exists(path) or is_repeat(asset):
                 continue
 
-            doc.add_picture(path, width=Inches(6.0))
+            doc.add_picture(path, width=Inches(DISPLAY_WIDTH_IN))
+            embedded.append(asset)
             inserted_images += 1
             if caption:
                 cap_p = doc.add_paragraph(caption)
@@ -46,8 +71,9 @@ def render_docx(doc_spec: Dict[str, Any], assets_by_id: Dict[str, dict], out_pat
         doc.add_heading("Images", level=1)
         for asset in list(assets_by_id.values())[:2]:
             path = asset.get("path")
-            if path and os.path.exists(path):
-                doc.add_picture(path, width=Inches(6.0))
+            if path and os.path.exists(path) and not is_repeat(asset):
+                doc.add_picture(path, width=Inches(DISPLAY_WIDTH_IN))
+                embedded.append(asset)
                 src = asset.get("source_url", "")
                 if src:
                     doc.add_paragraph(src)
@@ -58,5 +84,25 @@ def render_docx(doc_spec: Dict[str, Any], assets_by_id: Dict[str, dict], out_pat
         for r in refs:
             doc.add_paragraph(f"{r.get('title','Source')} — {r.get('url','')}")
 
-    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
-    doc.save(out_path)
+    if isinstance(out, str):
+        os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    doc.save(out)
+    return _embedded_media(doc)
+
+
+def render_docx_bytes(doc_spec: Dict[str, Any], assets_by_id: Dict[str, dict]) -> tuple[bytes, list[str]]:
+    buf = BytesIO()
+    media = render_docx(doc_spec, assets_by_id, buf)
+    return buf.getvalue(), media
+
+
+def _render_job(job: tuple) -> list[str]:
+    return render_docx(*job)
+
+
+def render_many(jobs: list[tuple[Dict[str, Any], Dict[str, dict], str]], workers: int = 0) -> list[list[str]]:
+    """Render (doc_spec, assets_by_id, out_path) jobs across a process pool; workers=0 uses all CPUs."""
+    if workers == 1 or len(jobs) <= 1:
+        return [_render_job(j) for j in jobs]
+    with ProcessPoolExecutor(max_workers=workers or None, initializer=_base_template) as pool:
+        return list(pool.map(_render_job, jobs, chunksize=max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4))))
@@ -0,0 +1,493 @@
+# resilience.py
+from __future__ import annotations
+
+import asyncio
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Optional
+
+from langchain_core.caches import BaseCache
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration
+
+from telemetry import bind
+
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF_S = float(os.getenv("LLM_BACKOFF_S", "0.5"))
+LLM_BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "8"))
+# Ceiling, and the timeout used until a model has enough samples for an adaptive one
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+LLM_TIMEOUT_MIN_S = float(os.getenv("LLM_TIMEOUT_MIN_S", "10"))
+LLM_TIMEOUT_P95_FACTOR = float(os.getenv("LLM_TIMEOUT_P95_FACTOR", "3"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1").lower() in ("1", "true", "yes")
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_S = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))
+MIN_SAMPLES = 20
+CACHED_REPLY_S = 0.05  # faster than this is a response-cache hit, not a network call
+
+LLM_POOL_WORKERS = int(os.getenv("LLM_POOL_WORKERS", "32"))
+
+_pool = ThreadPoolExecutor(max_workers=LLM_POOL_WORKERS, thread_name_prefix="llm")
+_load = {"queued": 0, "running": 0}  # running includes calls whose caller already gave up on them
+_load_lock = threading.Lock()
+
+
+class _Job:
+    """fn(*args) on the shared pool. t0 is when a worker picked it up: time spent queued
+    behind other calls is not the model's latency and does not count against its timeout."""
+
+    def __init__(self, fn: Callable[..., Any], *args: Any):
+        self.started = threading.Event()
+        self.t0 = 0.0
+        with _load_lock:
+            _load["queued"] += 1
+        self.future = _pool.submit(bind(self._run), fn, *args)
+
+    def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        with _load_lock:
+            _load["queued"] -= 1
+            _load["running"] += 1
+        self.t0 = time.perf_counter()
+        self.started.set()
+        try:
+            return fn(*args)
+        finally:
+            with _load_lock:
+                _load["running"] -= 1
+
+    def elapsed(self) -> float:
+        self.started.wait()
+        return time.perf_counter() - self.t0
+
+
+def _idle_worker() -> bool:
+    # Hedges only use spare capacity; on a busy pool they would queue ahead of other callers' first attempts
+    with _load_lock:
+        return _load["queued"] == 0 and _load["running"] < LLM_POOL_WORKERS
+
+
+class LatencyStats:
+    """Rolling latency window and counters for one model and output-size bucket."""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self.samples: deque[float] = deque(maxlen=window)
+        self.counts = {"calls": 0, "errors": 0, "timeouts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0, "aborts": 0}
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.counts["calls"] += 1
+            if seconds >= CACHED_REPLY_S:
+                self.samples.append(seconds)
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.counts[key] += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < MIN_SAMPLES:
+                return None
+            xs = sorted(self.samples)
+        return xs[min(len(xs) - 1, int(p * len(xs)))]
+
+    def timeout(self) -> float:
+        p95 = self.percentile(0.95)
+        if p95 is None:
+            return LLM_TIMEOUT_S
+        return min(LLM_TIMEOUT_S, max(LLM_TIMEOUT_MIN_S, p95 * LLM_TIMEOUT_P95_FACTOR))
+
+    def hedge_after(self) -> Optional[float]:
+        return self.percentile(0.95) if LLM_HEDGE else None
+
+    def to_dict(self) -> dict:
+        p50, p95, timeout = self.percentile(0.5), self.percentile(0.95), self.timeout()
+        with self._lock:
+            return {
+                **self.counts,
+                "samples": len(self.samples),
+                "p50_s": round(p50, 3) if p50 is not None else None,
+                "p95_s": round(p95, 3) if p95 is not None else None,
+                "timeout_s": round(timeout, 1),
+            }
+
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive errors; after cooldown_s lets one trial call through."""
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown_s: float = LLM_BREAKER_COOLDOWN_S):
+        self.threshold = failures
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.cooldown_s else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown_s:
+                self.opened_at = time.monotonic()  # one trial per cooldown
+                return True
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+_stats: dict[tuple[str, int], LatencyStats] = {}
+_breakers: dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def _bucket(max_tokens: int) -> int:
+    # Latency scales with output length, so calls are compared with calls of a similar size
+    b = 256
+    while b < max_tokens:
+        b *= 2
+    return b
+
+
+def stats_for(model: str, max_tokens: int) -> LatencyStats:
+    with _registry_lock:
+        return _stats.setdefault((model, _bucket(max_tokens)), LatencyStats())
+
+
+def breaker_for(model: str) -> CircuitBreaker:
+    with _registry_lock:
+        return _breakers.setdefault(model, CircuitBreaker())
+
+
+def latency_stats() -> dict:
+    with _registry_lock:
+        stats = dict(_stats)
+        breakers = dict(_breakers)
+    out = {f"{m}/{b}": s.to_dict() for (m, b), s in sorted(stats.items())}
+    for m, br in sorted(breakers.items()):
+        out.setdefault(f"{m}/breaker", {})["state"] = br.state
+    return out
+
+
+def _retryable(e: BaseException) -> bool:
+    code = getattr(e, "status_code", None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    return not isinstance(e, (ValueError, TypeError))
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: concurrent jobs retrying the same outage do not stampede together
+    return random.uniform(0, min(LLM_BACKOFF_MAX_S, LLM_BACKOFF_S * 2 ** attempt))
+
+
+class _Rejected(Exception):
+    """The consumer ended a stream (its error is the __cause__); not a model failure."""
+
+
+def _deliver(on_text: Callable[[str], Any], text: str) -> bool:
+    try:
+        return bool(on_text(text))
+    except Exception as e:
+        raise _Rejected() from e
+
+
+def _cache_key(model: BaseChatModel, prompt) -> Optional[tuple[BaseCache, str, str]]:
+    # BaseChatModel.stream() skips the response cache; use the same key as invoke() so both share it
+    if not isinstance(model.cache, BaseCache):
+        return None
+    from langchain_core.load import dumps
+
+    messages = model._convert_input(prompt).to_messages()
+    return model.cache, dumps(messages), model._get_llm_string()
+
+
+class _Attempt:
+    """One try of one model: which model, its stats and breaker, and the backoff before it."""
+
+    def __init__(self, model: BaseChatModel, stats: LatencyStats, breaker: CircuitBreaker, delay: float):
+        self.model, self.stats, self.breaker, self.delay = model, stats, breaker, delay
+        self.give_up = False
+
+    def succeeded(self) -> None:
+        self.breaker.success()
+
+    def rejected(self) -> None:
+        self.stats.count("aborts")
+        self.breaker.success()
+
+    def failed(self, e: BaseException) -> None:
+        self.stats.count("errors")
+        self.breaker.failure()
+        self.give_up = not _retryable(e) or self.breaker.state == "open"
+
+
+class ResilientChatModel:
+    """invoke()/ainvoke() over a primary and optional fallback chat model.
+
+    Each attempt gets a timeout derived from the model's recent p95 latency
+    and, once it runs past that p95, a hedged duplicate request; the first
+    reply wins. Retryable failures back off with jitter. A model whose
+    circuit breaker is open is skipped in favour of the fallback.
+    """
+
+    def __init__(
+        self,
+        primary: tuple[str, BaseChatModel],
+        fallback: Optional[tuple[str, BaseChatModel]],
+        max_tokens: int,
+        timeout_s: Optional[float] = None,
+    ):
+        self.models = [primary] + ([fallback] if fallback else [])
+        self.max_tokens = max_tokens
+        self.timeout_s = timeout_s
+
+    @property
+    def name(self) -> str:
+        return self.models[0][0]
+
+    def _timeout(self, stats: LatencyStats) -> float:
+        # The caller's cap (e.g. a short one for tool selection) bounds the adaptive timeout
+        timeout = stats.timeout()
+        return timeout if self.timeout_s is None else min(timeout, self.timeout_s)
+
+    def _targets(self) -> list[tuple[str, BaseChatModel]]:
+        allowed = [(name, m) for name, m in self.models if breaker_for(name).allow()]
+        return allowed or self.models[:1]  # everything open: the primary is still better than nothing
+
+    def _attempts(self):
+        """Retries of the first allowed model, then of the fallback; stops a model once attempt.give_up is set."""
+        for i, (name, model) in enumerate(self._targets()):
+            stats, breaker = stats_for(name, self.max_tokens), breaker_for(name)
+            if i:
+                stats.count("fallbacks")
+            for n in range(LLM_RETRIES + 1):
+                if n:
+                    stats.count("retries")
+                attempt = _Attempt(model, stats, breaker, _backoff(n) if n else 0.0)
+                yield attempt
+                if attempt.give_up:
+                    break
+
+    def _run(self, call: Callable[[BaseChatModel, LatencyStats, list[str]], Any]) -> Any:
+        last: Optional[BaseException] = None
+        for attempt in self._attempts():
+            time.sleep(attempt.delay)
+            parts: list[str] = []  # text already handed to a stream consumer
+            try:
+                out = call(attempt.model, attempt.stats, parts)
+            except _Rejected as r:
+                attempt.rejected()
+                raise r.__cause__
+            except Exception as e:
+                attempt.failed(e)
+                if parts:
+                    raise
+                last = e
+                continue
+            attempt.succeeded()
+            return out
+        raise last
+
+    async def _arun(self, call: Callable[[BaseChatModel, LatencyStats, list[str]], Awaitable[Any]]) -> Any:
+        last: Optional[BaseException] = None
+        for attempt in self._attempts():
+            await asyncio.sleep(attempt.delay)
+            parts: list[str] = []
+            try:
+                out = await call(attempt.model, attempt.stats, parts)
+            except _Rejected as r:
+                attempt.rejected()
+                raise r.__cause__
+            except Exception as e:
+                attempt.failed(e)
+                if parts:
+                    raise
+                last = e
+                continue
+            attempt.succeeded()
+            return out
+        raise last
+
+    def invoke(self, prompt: str | list[BaseMessage]) -> Any:
+        return self._run(lambda model, stats, parts: self._call(model, stats, prompt))
+
+    async def ainvoke(self, prompt: str | list[BaseMessage]) -> Any:
+        return await self._arun(lambda model, stats, parts: self._acall(model, stats, prompt))
+
+    def stream(self, prompt: str | list[BaseMessage], on_text: Callable[[str], Any]) -> str:
+        """invoke() for callers that consume the reply while it is generated; returns the text.
+
+        on_text gets every text delta as it arrives. It may raise (e.g. OffSchema) to abandon
+        the generation, which is re-raised here, or return True when it has all it needs, which
+        ends the call early. Retries and fallback only happen before the first delta (text that
+        was handed on cannot be taken back), and there is no hedging.
+        """
+        return self._run(lambda model, stats, parts: self._call_stream(model, stats, prompt, on_text, parts))
+
+    async def astream(self, prompt: str | list[BaseMessage], on_text: Callable[[str], Any]) -> str:
+        return await self._arun(lambda model, stats, parts: self._acall_stream(model, stats, prompt, on_text, parts))
+
+    def _call(self, model: BaseChatModel, stats: LatencyStats, prompt) -> Any:
+        timeout, hedge_after = self._timeout(stats), stats.hedge_after()
+        first = _Job(model.invoke, prompt)
+        jobs = [first]
+        if hedge_after is not None and hedge_after < timeout:
+            done, _ = wait([first.future], timeout=max(0.0, hedge_after - first.elapsed()))
+            if not done and _idle_worker():
+                stats.count("hedges")
+                jobs.append(_Job(model.invoke, prompt))
+        pending: set[Future] = {j.future for j in jobs}
+        err: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, timeout - first.elapsed()), return_when=FIRST_COMPLETED)
+            if not done:
+                # Abandoned calls run on until the client's own timeout (the call's cap, see llm.py)
+                stats.count("timeouts")
+                raise TimeoutError(f"LLM call exceeded {timeout:.1f}s")
+            for fut in done:
+                if fut.exception() is None:
+                    stats.record(first.elapsed())
+                    if fut is not first.future:
+                        stats.count("hedge_wins")
+                    return fut.result()
+                err = fut.exception()
+        raise err
+
+    async def _acall(self, model: BaseChatModel, stats: LatencyStats, prompt) -> Any:
+        timeout, hedge_after = self._timeout(stats), stats.hedge_after()
+        t0 = time.perf_counter()
+        first = asyncio.ensure_future(model.ainvoke(prompt))
+        tasks = [first]
+        try:
+            if hedge_after is not None and hedge_after < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done:
+                    stats.count("hedges")
+                    tasks.append(asyncio.ensure_future(model.ainvoke(prompt)))
+            pending = set(tasks)
+            err: Optional[BaseException] = None
+            while pending:
+                remaining = max(0.0, timeout - (time.perf_counter() - t0))
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    stats.count("timeouts")
+                    raise TimeoutError(f"LLM call exceeded {timeout:.1f}s")
+                for task in done:
+                    if task.exception() is None:
+                        stats.record(time.perf_counter() - t0)
+                        if task is not first:
+                            stats.count("hedge_wins")
+                        return task.result()
+                    err = task.exception()
+            raise err
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    @staticmethod
+    def _cached(model: BaseChatModel, stats: LatencyStats, prompt, on_text, parts: list[str]) -> Optional[str]:
+        key = _cache_key(model, prompt)
+        hit = key[0].lookup(key[1], key[2]) if key else None
+        if not hit:
+            return None
+        text = str(hit[0].text)
+        stats.record(0.0)
+        parts.append(text)
+        _deliver(on_text, text)
+        return text
+
+    @staticmethod
+    def _finished(model: BaseChatModel, stats: LatencyStats, prompt, parts: list[str], t0: float) -> str:
+        # Also cached when the consumer ended the stream because it had everything (the object closed):
+        # replayed, the same text ends it at the same place. Abandoned (OffSchema) replies never get here.
+        text = "".join(parts)
+        stats.record(time.perf_counter() - t0)
+        key = _cache_key(model, prompt)
+        if key:
+            key[0].update(key[1], key[2], [ChatGeneration(message=AIMessage(content=text))])
+        return text
+
+    def _call_stream(self, model: BaseChatModel, stats: LatencyStats, prompt, on_text, parts: list[str]) -> str:
+        cached = self._cached(model, stats, prompt, on_text, parts)
+        if cached is not None:
+            return cached
+        timeout = self._timeout(stats)
+        deltas: queue.Queue = queue.Queue()
+        stop = threading.Event()
+
+        def produce() -> None:
+            it = model.stream(prompt)
+            try:
+                for chunk in it:
+                    if stop.is_set():
+                        break
+                    deltas.put(chunk.content)
+                deltas.put(None)
+            except BaseException as e:
+                deltas.put(e)
+            finally:
+                it.close()
+
+        job = _Job(produce)  # an abandoned producer stops at its next delta
+        try:
+            while True:
+                try:
+                    item = deltas.get(timeout=max(0.0, timeout - job.elapsed()))
+                except queue.Empty:
+                    stats.count("timeouts")
+                    raise TimeoutError(f"LLM stream exceeded {timeout:.1f}s") from None
+                if item is None:
+                    return self._finished(model, stats, prompt, parts, job.t0)
+                if isinstance(item, BaseException):
+                    raise item
+                if item:
+                    parts.append(str(item))
+                    if _deliver(on_text, str(item)):
+                        return self._finished(model, stats, prompt, parts, job.t0)
+        finally:
+            stop.set()
+
+    async def _acall_stream(self, model: BaseChatModel, stats: LatencyStats, prompt, on_text, parts: list[str]) -> str:
+        cached = self._cached(model, stats, prompt, on_text, parts)
+        if cached is not None:
+            return cached
+        timeout = self._timeout(stats)
+        t0 = time.perf_counter()
+        it = model.astream(prompt)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(it.__anext__(), max(0.0, timeout - (time.perf_counter() - t0)))
+                except StopAsyncIteration:
+                    return self._finished(model, stats, prompt, parts, t0)
+                except asyncio.TimeoutError:
+                    stats.count("timeouts")
+                    raise TimeoutError(f"LLM stream exceeded {timeout:.1f}s") from None
+                if chunk.content:
+                    parts.append(str(chunk.content))
+                    if _deliver(on_text, str(chunk.content)):
+                        return self._finished(model, stats, prompt, parts, t0)
+        finally:
+            await it.aclose()
@@ -0,0 +1,151 @@
+# search_cache.py
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(str(query).lower().split())
+
+
+class SearchCache:
+    """SQLite-backed search cache with TTL, LRU size cap and stale-while-revalidate.
+
+    Entries younger than ttl_s are fresh. Entries up to ttl_s + stale_s old are
+    served immediately while a background refresh replaces them. In offline
+    mode any cached entry is served and the network is never used.
+    """
+
+    def __init__(self, path: Path, ttl_s: float, stale_s: float, max_entries: int, offline: bool = False):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.stale_s = stale_s
+        self.max_entries = max_entries
+        self.offline = offline
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._refreshing: set[str] = set()
+        self._refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search_refresh")
+        self._refresh_tasks: set[asyncio.Task] = set()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                " key TEXT PRIMARY KEY, query TEXT, payload TEXT, fetched_at REAL, used_at REAL)"
+            )
+        return self._conn
+
+    @staticmethod
+    def key(query: str, params: dict) -> str:
+        blob = json.dumps({"q": normalize_query(query), "p": params}, sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _get(self, key: str) -> tuple[Any, float] | None:
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT payload, fetched_at FROM search_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE search_cache SET used_at = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), time.time() - row[1]
+
+    def _put(self, key: str, query: str, payload: Any) -> None:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?, ?)",
+                (key, query, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+            db.execute(
+                "DELETE FROM search_cache WHERE key IN ("
+                " SELECT key FROM search_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def _refresh(self, key: str, query: str, fetch: Callable[[], Any]) -> None:
+        try:
+            self._put(key, query, fetch())
+        except Exception:
+            pass  # keep serving the stale entry
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _lookup(self, key: str) -> tuple[Any, bool] | None:
+        """Return (payload, needs_refresh) for a servable entry, else None."""
+        cached = self._get(key)
+        if cached is None:
+            return None
+        payload, age = cached
+        if age <= self.ttl_s or self.offline:
+            self.hits += 1
+            return payload, False
+        if age <= self.ttl_s + self.stale_s:
+            self.stale_hits += 1
+            with self._lock:
+                start = key not in self._refreshing
+                self._refreshing.add(key)
+            return payload, start
+        return None
+
+    def get_or_fetch(self, query: str, params: dict, fetch: Callable[[], Any]) -> Any:
+        key = self.key(query, params)
+        found = self._lookup(key)
+        if found is not None:
+            payload, refresh = found
+            if refresh:
+                self._refresh_pool.submit(self._refresh, key, query, fetch)
+            return payload
+        if self.offline:
+            raise LookupError(f"Offline search cache has no entry for: {query!r}")
+        self.misses += 1
+        payload = fetch()
+        self._put(key, query, payload)
+        return payload
+
+    async def _arefresh(self, key: str, query: str, fetch: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            self._put(key, query, await fetch())
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def aget_or_fetch(self, query: str, params: dict, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        key = self.key(query, params)
+        found = self._lookup(key)
+        if found is not None:
+            payload, refresh = found
+            if refresh:
+                task = asyncio.get_running_loop().create_task(self._arefresh(key, query, fetch))
+                self._refresh_tasks.add(task)
+                task.add_done_callback(self._refresh_tasks.discard)
+            return payload
+        if self.offline:
+            raise LookupError(f"Offline search cache has no entry for: {query!r}")
+        self.misses += 1
+        payload = await fetch()
+        self._put(key, query, payload)
+        return payload
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db().execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+        return {"hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses, "entries": entries}
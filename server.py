@@ -0,0 +1,282 @@
+# server.py
+# Long-running service: the graph, HTTP pools, chat model clients and caches are built once
+# and shared by every job, so a job only pays for model and tool time.
+#
+#   python server.py --port 8080 --workers 4
+#   curl -X POST localhost:8080/jobs -d '{"topic": "RAG", "words": 1500}'
+#   curl -N localhost:8080/jobs/<id>/events            # NDJSON progress, ends when the job does
+#   curl -o blog.docx "localhost:8080/jobs/<id>/docx?wait=1"
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import app
+import llm
+import tools
+from telemetry import METRICS
+
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "4"))
+SERVICE_MAX_QUEUE = int(os.getenv("SERVICE_MAX_QUEUE", "32"))
+SERVICE_KEEP_JOBS = int(os.getenv("SERVICE_KEEP_JOBS", "500"))
+SERVICE_OUT_DIR = os.getenv("SERVICE_OUT_DIR", os.path.join("output", "service"))
+MAX_WORDS = 6000
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, topic: str, words: int, mode: str, speculative: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.topic = topic
+        self.words = words
+        self.mode = mode
+        self.speculative = speculative
+        self.status = "queued"
+        self.created = time.time()
+        self.events: list[dict] = []
+        self.out_path: Optional[str] = None
+        self.error: Optional[str] = None
+        self.cond = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error")
+
+    def emit(self, event: dict) -> None:
+        with self.cond:
+            self.events.append({"t": round(time.time() - self.created, 3), **event})
+            self.cond.notify_all()
+
+    def set_status(self, status: str, **info) -> None:
+        with self.cond:
+            self.status = status
+            self.events.append({"t": round(time.time() - self.created, 3), "status": status, **info})
+            self.cond.notify_all()
+
+    def to_dict(self) -> dict:
+        with self.cond:
+            d = {
+                "id": self.id,
+                "topic": self.topic,
+                "words": self.words,
+                "mode": self.mode,
+                "status": self.status,
+                "events": len(self.events),
+            }
+            if self.error:
+                d["error"] = self.error
+            if self.status == "done":
+                d["docx_url"] = f"/jobs/{self.id}/docx"
+            return d
+
+
+class JobQueue:
+    """Bounded queue in front of a fixed pool of job threads; submit() refuses work beyond max_pending."""
+
+    def __init__(self, workers: int, max_pending: int, out_root: str):
+        self.out_root = out_root
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+
+    def submit(self, topic: str, words: int, mode: str, speculative: bool) -> Job:
+        job = Job(topic, words, mode, speculative)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} jobs pending")
+            self._pending += 1
+            self.jobs[job.id] = job
+            # Forget the oldest finished jobs (their files stay on disk)
+            while len(self.jobs) > SERVICE_KEEP_JOBS:
+                old = next((k for k, j in self.jobs.items() if j.finished), None)
+                if old is None:
+                    break
+                del self.jobs[old]
+        self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job: Job) -> None:
+        job.set_status("running")
+        try:
+            out_dir = os.path.join(self.out_root, job.id)
+            os.makedirs(out_dir, exist_ok=True)
+            job.out_path = app.run(
+                job.topic, job.words, out_dir=out_dir, mode=job.mode, speculative=job.speculative, on_event=job.emit
+            )
+            job.set_status("done", docx_url=f"/jobs/{job.id}/docx")
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.set_status("error", error=job.error)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts: dict[str, int] = {}
+            for j in self.jobs.values():
+                counts[j.status] = counts.get(j.status, 0) + 1
+            return {"pending": self._pending, "max_pending": self.max_pending, **counts}
+
+
+def make_handler(queue: JobQueue):
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "blog-generator"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _json(self, code: int, body: dict) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _job(self, job_id: str) -> Optional[Job]:
+            job = queue.get(job_id)
+            if job is None:
+                self._json(404, {"error": f"unknown job {job_id}"})
+            return job
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/jobs":
+                return self._json(404, {"error": "not found"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                topic = str(body.get("topic") or body.get("title") or "").strip()
+                words = int(body.get("words") or body.get("target_words") or 1500)
+                mode = str(body.get("mode") or "outline")
+            except (ValueError, TypeError, AttributeError) as e:
+                return self._json(400, {"error": f"bad request: {e}"})
+            if not topic or not 100 <= words <= MAX_WORDS or mode not in ("outline", "delta", "expand"):
+                return self._json(400, {"error": f"need a topic, 100 <= words <= {MAX_WORDS}, mode outline|delta|expand"})
+            try:
+                job = queue.submit(topic, words, mode, bool(body.get("speculative")))
+            except QueueFull as e:
+                return self._json(429, {"error": f"queue full: {e}"})
+            self._json(202, {**job.to_dict(), "events_url": f"/jobs/{job.id}/events"})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/healthz":
+                return self._json(200, {"ok": True, "queue": queue.stats(), "llm": llm.llm_latency_stats()})
+            if url.path == "/metrics":
+                data = METRICS.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                return self.wfile.write(data)
+
+            m = re.fullmatch(r"/jobs/(\w+)(?:/(events|docx))?", url.path)
+            if not m:
+                return self._json(404, {"error": "not found"})
+            job = self._job(m.group(1))
+            if job is None:
+                return
+            if m.group(2) is None:
+                return self._json(200, {**job.to_dict(), "log": list(job.events)})
+            if m.group(2) == "events":
+                return self._stream_events(job)
+            return self._docx(job, wait="wait" in query)
+
+        def _stream_events(self, job: Job) -> None:
+            # HTTP/1.0 style: no Content-Length, the connection closes when the job is finished
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            sent = 0
+            while True:
+                with job.cond:
+                    while sent >= len(job.events) and not job.finished:
+                        job.cond.wait(timeout=15)
+                    batch = job.events[sent:]
+                    sent += len(batch)
+                    done = job.finished and sent == len(job.events)
+                try:
+                    for ev in batch:
+                        self.wfile.write(json.dumps(ev, ensure_ascii=False).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                if done:
+                    return
+
+        def _docx(self, job: Job, wait: bool) -> None:
+            if wait:
+                with job.cond:
+                    job.cond.wait_for(lambda: job.finished)
+            if job.status == "error":
+                return self._json(500, {"error": job.error})
+            if job.status != "done" or not job.out_path:
+                return self._json(409, {"error": f"job is {job.status}", "status_url": f"/jobs/{job.id}"})
+            with open(job.out_path, "rb") as f:
+                data = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+            self.send_header("Content-Disposition", f'attachment; filename="{job.id}.docx"')
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def serve(host: str, port: int, workers: int, max_pending: int, out_root: str) -> ThreadingHTTPServer:
+    # app imports lazily; pay for the graph, the clients and the provider SDK here, not in the first job
+    import graph  # noqa: F401
+
+    for stage in llm.STAGES:
+        llm.stage_models(stage)
+    tools._tavily_client()
+    queue = JobQueue(workers, max_pending, out_root)
+    httpd = ThreadingHTTPServer((host, port), make_handler(queue))
+    httpd.daemon_threads = True
+    return httpd
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="Jobs running at once")
+    p.add_argument("--max-queue", type=int, default=SERVICE_MAX_QUEUE, help="Queued + running jobs before 429")
+    p.add_argument("--out-dir", default=SERVICE_OUT_DIR)
+    p.add_argument("--groq-rps", type=float, help="Max Groq requests/second across all jobs")
+    p.add_argument("--tavily-rps", type=float, help="Max Tavily requests/second across all jobs")
+    args = p.parse_args()
+
+    if args.groq_rps is not None:
+        llm.GROQ_LIMITER = llm.rate_limiter(args.groq_rps)
+    if args.tavily_rps is not None:
+        tools.TAVILY_LIMITER = llm.rate_limiter(args.tavily_rps)
+
+    httpd = serve(args.host, args.port, args.workers, args.max_queue, args.out_dir)
+    print(f"Serving on http://{args.host}:{httpd.server_port} ({args.workers} workers)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -2,18 +2,41 @@
 from __future__ import annotations
 
 import operator
-from typing import Annotated, TypedDict, Union
+from dataclasses import dataclass
+from typing import Annotated, Any, Optional, TypedDict, Union
 
 from langchain_core.agents import AgentAction, AgentFinish
 
+# Steps a prompt ever shows; the state keeps no more than this
+MAX_STEPS_IN_CONTEXT = 3
+
+
 class Asset(TypedDict):
     asset_id: str
     path: str
     source_url: str
 
+
+@dataclass(frozen=True, slots=True)
+class Step:
+    """One tool call and its observation. A long observation lives in the step store
+    (see step_store.py) and is referenced by id."""
+
+    tool: str
+    tool_input: Any
+    observation: str = ""  # inline when short, else "" and observation_id is set
+    observation_id: Optional[str] = None
+
+
+def recent_steps(left: list[Step], right: list[Step]) -> list[Step]:
+    """Reducer: a ring of the newest MAX_STEPS_IN_CONTEXT steps; step_count keeps the total."""
+    return (left + right)[-MAX_STEPS_IN_CONTEXT:]
+
+
 class AgentState(TypedDict):
     topic: str
-    target_words: int                 
-    agent_outcome: Union[AgentAction, AgentFinish, None]
-    intermediate_steps: Annotated[list[tuple[AgentAction, str]], operator.add]
+    target_words: int
+    agent_outcome: Union[AgentAction, list[AgentAction], AgentFinish, None]  # a list: calls run in parallel
+    intermediate_steps: Annotated[list[Step], recent_steps]
+    step_count: Annotated[int, operator.add]
     assets: Annotated[list[Asset], operator.add]
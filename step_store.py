@@ -0,0 +1,92 @@
+# step_store.py
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from state import Step
+
+BASE_DIR = Path(__file__).resolve().parent
+STEP_STORE_PATH = Path(os.getenv("STEP_STORE_PATH", str(BASE_DIR / "output" / "steps.sqlite")))
+STEP_STORE_MAX_ENTRIES = int(os.getenv("STEP_STORE_MAX_ENTRIES", "5000"))
+INLINE_CHARS = 400  # shorter observations stay in the state itself
+
+
+class StepStore:
+    """Content-addressed SQLite store for the bulky text of agent steps.
+
+    The graph state (and so every superstep copy and checkpoint) carries only
+    an id; identical text from concurrent or repeated runs is stored once.
+    Persistent, so a resumed run finds its observations again. Oldest-used
+    entries are dropped beyond max_entries.
+    """
+
+    def __init__(self, path: Path, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS step_text (id TEXT PRIMARY KEY, body TEXT, used_at REAL)")
+        return self._conn
+
+    def put(self, text: str) -> str:
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+        with self._lock:
+            db = self._db()
+            # Storing a text again counts as a use, so the trim below never drops what was just recorded
+            db.execute(
+                "INSERT INTO step_text VALUES (?, ?, ?) ON CONFLICT(id) DO UPDATE SET used_at = excluded.used_at",
+                (key, text, time.time()),
+            )
+            db.execute(
+                "DELETE FROM step_text WHERE id IN ("
+                " SELECT id FROM step_text ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        return key
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT body FROM step_text WHERE id = ?", (key,)).fetchone()
+            if row is not None:
+                db.execute("UPDATE step_text SET used_at = ? WHERE id = ?", (time.time(), key))
+        return row[0] if row else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM step_text").fetchone()
+        return {"entries": entries, "chars": size}
+
+
+STEP_STORE = StepStore(STEP_STORE_PATH, STEP_STORE_MAX_ENTRIES)
+
+
+def record_step(action: Any, observation: str) -> Step:
+    """A compact Step for an AgentAction and its observation (the action's raw log is not kept)."""
+    observation = str(observation)
+    big = len(observation) > INLINE_CHARS
+    return Step(
+        tool=action.tool,
+        tool_input=action.tool_input,
+        observation="" if big else observation,
+        observation_id=STEP_STORE.put(observation) if big else None,
+    )
+
+
+def observation_text(step: Step) -> str:
+    if step.observation_id is None:
+        return step.observation
+    text = STEP_STORE.get(step.observation_id)
+    return text if text is not None else "(observation no longer stored)"
@@ -0,0 +1,178 @@
+# stream_json.py
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Callable, Optional
+
+# Prose / code fences tolerated before the opening brace of a JSON-only reply
+PREAMBLE_CHARS = int(os.getenv("STREAM_PREAMBLE_CHARS", "400"))
+
+_WS = " \t\r\n"
+_TYPES = {'"': "a string", "[": "an array", "{": "an object"}
+
+
+class OffSchema(ValueError):
+    """A streamed reply that can no longer match the expected schema."""
+
+
+def extract_json_object(text: str) -> Optional[str]:
+    """The first complete JSON object in text; prose, code fences and trailing notes around it are dropped."""
+    dec = json.JSONDecoder()
+    i = text.find("{")
+    while i != -1:
+        try:
+            _, end = dec.raw_decode(text, i)
+            return text[i:end]
+        except ValueError:
+            i = text.find("{", i + 1)
+    return None
+
+
+class ObjectStream:
+    """Incremental parser for a streamed reply holding one JSON object.
+
+    fields maps top-level keys to the first character their value must start
+    with ('"', '[' or '{'); items_key names the array whose elements are
+    decoded as soon as each one closes, checked with item_ok and passed to
+    on_item. feed() raises OffSchema the moment the reply cannot match: no
+    object within PREAMBLE_CHARS, a value of the wrong type, broken syntax at
+    the top level, or an item that fails item_ok. Once the object closes,
+    done is True and the rest of the generation is not needed.
+    """
+
+    def __init__(
+        self,
+        fields: dict[str, str],
+        items_key: str,
+        item_ok: Callable[[Any], bool],
+        on_item: Optional[Callable[[int, dict], None]] = None,
+        preamble: int = PREAMBLE_CHARS,
+    ):
+        self.fields = fields
+        self.items_key = items_key
+        self.item_ok = item_ok
+        self.on_item = on_item
+        self.preamble = preamble
+        self.items: list[dict] = []
+        self.done = False
+        self._seen = 0
+        self._obj: list[str] = []  # the object's text, from its opening brace
+        self._item: Optional[list[str]] = None
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._expect = "key"  # at depth 1: key, colon, value or comma
+        self._key: list[str] = []
+        self._scalar = False
+        self._in_items = False
+
+    def feed(self, text: str) -> bool:
+        """Consume the next piece of the reply; returns done."""
+        for ch in text:
+            if self.done:
+                break
+            self._char(ch)
+        return self.done
+
+    def result(self) -> str:
+        return "".join(self._obj)
+
+    def _char(self, ch: str) -> None:
+        if self._depth == 0:
+            self._seen += 1
+            if ch == "{":
+                self._depth = 1
+                self._obj.append(ch)
+            elif self._seen > self.preamble:
+                raise OffSchema(f"no JSON object in the first {self.preamble} characters")
+            return
+
+        self._obj.append(ch)
+        if self._item is not None:
+            self._item.append(ch)
+
+        if self._in_str:
+            if self._esc:
+                self._esc = False
+            elif ch == "\\":
+                self._esc = True
+            elif ch == '"':
+                self._in_str = False
+                if self._depth == 1 and self._expect == "key":
+                    self._expect = "colon"
+            elif self._depth == 1 and self._expect == "key":
+                self._key.append(ch)
+            return
+
+        if self._depth == 1:
+            self._top_level(ch)
+        elif self._in_items and self._depth == 2:
+            self._items_level(ch)
+        elif ch == '"':
+            self._in_str = True
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._close()
+
+    def _top_level(self, ch: str) -> None:
+        if ch in _WS:
+            return
+        if self._expect == "key":
+            if ch == '"':
+                self._in_str, self._key = True, []
+            elif ch != "}":
+                raise OffSchema(f"expected a key, got {ch!r}")
+            else:
+                self._close()
+        elif self._expect == "colon":
+            if ch != ":":
+                raise OffSchema(f"expected ':' after key, got {ch!r}")
+            self._expect = "value"
+        elif self._expect == "value":
+            key = "".join(self._key)
+            want = self.fields.get(key)
+            if want is not None and ch != want:
+                raise OffSchema(f'"{key}" must be {_TYPES[want]}')
+            self._expect = "comma"
+            self._scalar = ch not in '"{['
+            if ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                self._depth += 1
+                self._in_items = key == self.items_key and ch == "["
+        elif ch == ",":
+            self._expect = "key"
+        elif ch == "}":
+            self._close()
+        elif not self._scalar:  # the rest of a number or literal is let through
+            raise OffSchema(f"unexpected {ch!r} at the top level")
+
+    def _items_level(self, ch: str) -> None:
+        if ch in _WS or ch == ",":
+            return
+        if ch == "]":
+            self._in_items = False
+            self._depth = 1
+        elif ch == "{":
+            self._depth = 3
+            self._item = [ch]
+        else:
+            raise OffSchema(f'"{self.items_key}" items must be objects, got {ch!r}')
+
+    def _close(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            self.done = True
+        elif self._depth == 2 and self._in_items and self._item is not None:
+            raw, self._item = "".join(self._item), None
+            try:
+                item = json.loads(raw)
+            except ValueError as e:
+                raise OffSchema(f"malformed {self.items_key} item: {e}") from None
+            if not self.item_ok(item):
+                raise OffSchema(f"{self.items_key} item {len(self.items)} does not match the schema")
+            self.items.append(item)
+            if self.on_item is not None:
+                self.on_item(len(self.items) - 1, item)
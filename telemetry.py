@@ -0,0 +1,193 @@
+# telemetry.py
+from __future__ import annotations
+
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("telemetry_trace", default=None)
+
+
+class Trace:
+    """Flat list of finished spans for one run."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.t0 = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: list[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, rec: dict) -> None:
+        with self._lock:
+            self.spans.append(rec)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda r: r["start_ms"])
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round((time.perf_counter() - self.t0) * 1000, 3),
+            "spans": spans,
+        }
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+class _Metrics:
+    """Process-wide aggregates per span name: count, errors, seconds, tokens."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.data: dict[str, dict[str, float]] = {}
+
+    def observe(self, name: str, seconds: float, error: bool, attrs: dict) -> None:
+        with self._lock:
+            m = self.data.setdefault(name, {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0})
+            m["count"] += 1
+            m["errors"] += int(error)
+            m["seconds"] += seconds
+            m["max_seconds"] = max(m["max_seconds"], seconds)
+            for key in ("prompt_tokens", "completion_tokens", "bytes"):
+                if isinstance(attrs.get(key), (int, float)):
+                    m[key] = m.get(key, 0) + attrs[key]
+
+    def prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            items = sorted(self.data.items())
+        for metric, key, kind, help_ in (
+            ("blog_span_total", "count", "counter", "Spans finished"),
+            ("blog_span_errors_total", "errors", "counter", "Spans that raised"),
+            ("blog_span_seconds_sum", "seconds", "counter", "Total seconds spent in span"),
+            ("blog_span_seconds_max", "max_seconds", "gauge", "Slowest single span"),
+            ("blog_llm_prompt_tokens_total", "prompt_tokens", "counter", "Prompt tokens"),
+            ("blog_llm_completion_tokens_total", "completion_tokens", "counter", "Completion tokens"),
+            ("blog_bytes_total", "bytes", "counter", "Bytes produced"),
+        ):
+            rows = [(name, m[key]) for name, m in items if key in m]
+            if not rows:
+                continue
+            lines.append(f"# HELP {metric} {help_}")
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.extend(f'{metric}{{span="{name}"}} {value:g}' for name, value in rows)
+        return "\n".join(lines) + "\n"
+
+
+METRICS = _Metrics()
+
+
+def start_trace(name: str) -> Trace:
+    """Start collecting spans for the current context (one run / job)."""
+    trace = Trace(name)
+    _current.set(trace)
+    return trace
+
+
+def _finish(name: str, t0: float, attrs: dict, error: Optional[BaseException]) -> None:
+    seconds = time.perf_counter() - t0
+    METRICS.observe(name, seconds, error is not None, attrs)
+    trace = _current.get()
+    if trace is not None:
+        rec = {
+            "name": name,
+            "start_ms": round((t0 - trace.t0) * 1000, 3),
+            "duration_ms": round(seconds * 1000, 3),
+            "thread": threading.current_thread().name,
+            **attrs,
+        }
+        if error is not None:
+            rec["error"] = f"{type(error).__name__}: {error}"
+        trace.add(rec)
+
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """Time a block; the yielded dict can be filled with extra attributes (sizes, counts)."""
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        _finish(name, t0, attrs, e)
+        raise
+    _finish(name, t0, attrs, None)
+
+
+def traced(name: str):
+    """Decorator form of span() for sync and async functions."""
+
+    def deco(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return deco
+
+
+def bind(fn):
+    """Wrap fn so each call runs in a copy of the caller's context (for thread pools)."""
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+class LLMTelemetry(BaseCallbackHandler):
+    """Records one "llm" span per chat model call with latency and token usage."""
+
+    run_inline = True  # keep the caller's contextvars in async runs
+
+    def __init__(self):
+        self._starts: dict[UUID, tuple[float, dict]] = {}
+
+    def on_chat_model_start(self, serialized: dict, messages: list, *, run_id: UUID, **kwargs: Any) -> None:
+        params = kwargs.get("invocation_params") or {}
+        attrs = {"model": params.get("model") or params.get("model_name") or params.get("_type", "")}
+        if params.get("max_tokens"):
+            attrs["max_tokens"] = params["max_tokens"]
+        attrs["prompt_chars"] = sum(len(str(m.content)) for batch in messages for m in batch)
+        self._starts[run_id] = (time.perf_counter(), attrs)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        t0, attrs = self._starts.pop(run_id, (time.perf_counter(), {}))
+        try:
+            msg = response.generations[0][0].message
+            usage = getattr(msg, "usage_metadata", None) or {}
+            attrs["prompt_tokens"] = usage.get("input_tokens", 0)
+            attrs["completion_tokens"] = usage.get("output_tokens", 0)
+            attrs["completion_chars"] = len(str(msg.content))
+        except (AttributeError, IndexError):
+            pass
+        _finish("llm", t0, attrs, None)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        t0, attrs = self._starts.pop(run_id, (time.perf_counter(), {}))
+        _finish("llm", t0, attrs, error)
+
+
+LLM_TELEMETRY = LLMTelemetry()
@@ -1,44 +1,138 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import json
-import uuid
-from io import BytesIO
+import os
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, Optional
 
-import requests
 from dotenv import load_dotenv
-from langchain.tools import tool
-from langchain_tavily import TavilySearch
-from PIL import Image
+from langchain_core.tools import StructuredTool
+
+from asset_store import AssetStore
+from dedup import distinct_ranked
+from image_pipeline import (
+    DISPLAY_WIDTH_IN, MAGIC_BYTES, NORMALIZE, TARGET_DPI, image_info, image_size, near_duplicate, normalize_image,
+    sniff_image_type, to_png,
+)
+from llm import rate_limiter
+from search_cache import SearchCache
+from telemetry import bind, span
 
 load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent
 OUT_DIR = BASE_DIR / "output"
-ASSETS_DIR = OUT_DIR / "assets"
-OUT_DIR.mkdir(exist_ok=True)
-ASSETS_DIR.mkdir(exist_ok=True)
-
-_tavily = TavilySearch(
-    max_results=5,
-    search_depth="basic",
-    include_images=True,
-    include_image_descriptions=True,
+ASSETS_DIR = OUT_DIR / "assets"  # created by the asset store on first write
+
+SEARCH_RESULTS = 5  # distinct results kept per search
+_TAVILY_PARAMS = {
+    "max_results": 8,  # a few spare candidates, so mirrors dropped by dedup still leave SEARCH_RESULTS
+    "search_depth": "basic",
+    "include_images": True,
+    "include_image_descriptions": True,
+}
+_tavily: Any = None  # TavilySearch, built on first search (tests may assign a stand-in)
+_clients_lock = threading.Lock()
+
+TAVILY_LIMITER = rate_limiter(float(os.getenv("TAVILY_RPS", "0")))
+
+SEARCH_CACHE = SearchCache(
+    Path(os.getenv("SEARCH_CACHE_PATH", str(OUT_DIR / "search_cache.sqlite"))),
+    ttl_s=float(os.getenv("SEARCH_CACHE_TTL_S", str(24 * 3600))),
+    stale_s=float(os.getenv("SEARCH_CACHE_STALE_S", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "5000")),
+    offline=os.getenv("SEARCH_OFFLINE", "").lower() in {"1", "true", "yes"},
 )
 
 ALLOWED_IMAGE_MIME = {"image/jpeg", "image/png", "image/webp"}
 MAX_BYTES = 5 * 1024 * 1024  # 5MB
+DOWNLOAD_CHUNK = 64 * 1024  # bytes held in memory per download at a time
 
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))
+IMAGE_TIMEOUT = (5, 20)  # (connect, read) seconds
+IMAGE_DEADLINE_S = float(os.getenv("IMAGE_DEADLINE_S", "20"))
+# Candidate images are first read up to this many bytes (a Range request): enough for the header,
+# and the whole file for most diagrams, which can then be hashed without a second round trip
+PROBE_BYTES = int(os.getenv("IMAGE_PROBE_BYTES", str(64 * 1024)))
+MIN_IMAGE_PX = int(os.getenv("IMAGE_MIN_PX", "200"))  # narrower candidates are icons and logos
+
+_http = None  # requests.Session, built on first download
+_fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch_image")
+# Async twin, one client per event loop (httpx clients are bound to the loop that created them)
+_ahttp_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+ASSET_STORE = AssetStore(ASSETS_DIR, max_bytes=int(os.getenv("ASSET_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+
+def _tavily_client():
+    global _tavily
+    if _tavily is None:
+        with _clients_lock:
+            if _tavily is None:
+                from langchain_tavily import TavilySearch
+
+                _tavily = TavilySearch(**_TAVILY_PARAMS)
+    return _tavily
 
-@tool("web_search", description="Search the web using Tavily. Input: query string. Output: compact JSON {results, images}.")
-def web_search(query: str) -> str:
-    """Search Tavily and return compact JSON with results and image URLs."""
-    data = _tavily.invoke({"query": query})  # Tavily expects {"query": "..."} :contentReference[oaicite:3]{index=3}
 
+def _session():
+    # One pooled session for all image downloads: keep-alive connections are reused per host
+    global _http
+    if _http is None:
+        with _clients_lock:
+            if _http is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS))
+                session.mount("http://", HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS))
+                _http = session
+    return _http
+
+
+def _ahttp():
+    """httpx.AsyncClient for the running loop."""
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _ahttp_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(IMAGE_TIMEOUT[1], connect=IMAGE_TIMEOUT[0]),
+            limits=httpx.Limits(max_connections=FETCH_WORKERS * 4, max_keepalive_connections=FETCH_WORKERS),
+            follow_redirects=True,
+        )
+        _ahttp_clients[loop] = client
+    return client
+
+
+def _tavily_search(query: str) -> dict:
+    # Rate limit only real API calls; cache hits are free
+    if TAVILY_LIMITER is not None:
+        TAVILY_LIMITER.acquire()
+    return _tavily_client().invoke({"query": query})
+
+
+async def _atavily_search(query: str) -> dict:
+    if TAVILY_LIMITER is not None:
+        await TAVILY_LIMITER.aacquire()
+    return await _tavily_client().ainvoke({"query": query})
+
+
+def _compact_search(query: str, data) -> str:
     out = {"query": query, "results": [], "images": []}
 
     if isinstance(data, dict):
-        for r in (data.get("results") or [])[:5]:
+        results = [r for r in data.get("results") or [] if isinstance(r, dict)]
+        for r in distinct_ranked(query, results, SEARCH_RESULTS):
             out["results"].append(
                 {
                     "title": r.get("title"),
@@ -52,34 +146,361 @@ def web_search(query: str) -> str:
     return json.dumps(out, ensure_ascii=False)
 
 
-@tool("fetch_image", description="Download image URL (PNG/JPEG/WebP) to output/assets. Returns JSON {asset_id,path,source_url}.")
-def fetch_image(url: str) -> str:
+def _web_search(query: str) -> str:
+    """Search Tavily and return compact JSON with results and image URLs."""
+    # Tavily expects {"query": "..."} :contentReference[oaicite:3]{index=3}
+    data = SEARCH_CACHE.get_or_fetch(query, _TAVILY_PARAMS, lambda: _tavily_search(query))
+    return _compact_search(query, data)
+
+
+async def _aweb_search(query: str) -> str:
+    data = await SEARCH_CACHE.aget_or_fetch(query, _TAVILY_PARAMS, lambda: _atavily_search(query))
+    return _compact_search(query, data)
+
+
+web_search = StructuredTool.from_function(
+    func=_web_search,
+    coroutine=_aweb_search,
+    name="web_search",
+    description="Search the web using Tavily. Input: query string. Output: compact JSON {results, images}.",
+)
+
+
+def _image_meta(source: bytes | Path, size: Optional[int] = None) -> Optional[dict]:
+    try:
+        return {**image_info(source), "bytes": len(source) if size is None else size}
+    except Exception:
+        return None
+
+
+class _Spool:
+    """One image body, checked as it arrives and written straight to a temp file in the asset store.
+
+    Rejects on Content-Length before reading anything, on the running byte
+    count as chunks arrive, and on the file's magic bytes (the Content-Type
+    header is not trusted), so memory per download is one chunk.
+    """
+
+    def __init__(self, url: str, headers=None):
+        length = (headers or {}).get("Content-Length") or ""
+        if length.isdigit() and int(length) > MAX_BYTES:
+            raise ValueError(f"Image too large ({int(length)} bytes > {MAX_BYTES})")
+        self.url = url
+        self.ctype: Optional[str] = None
+        self.size = 0
+        self._head = b""
+        self._sha = hashlib.sha256()
+        ASSET_STORE.root.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(dir=ASSET_STORE.root, prefix=".download-", suffix=".part")
+        self.path = Path(name)
+        self._file = os.fdopen(fd, "wb")
+
+    def __enter__(self) -> _Spool:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+    def feed(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > MAX_BYTES:
+            raise ValueError(f"Image too large (>{MAX_BYTES} bytes)")
+        if self.ctype is None:
+            self._head += chunk[:MAGIC_BYTES]
+            if len(self._head) >= MAGIC_BYTES:
+                self._sniff()
+        self._sha.update(chunk)
+        self._file.write(chunk)
+
+    def _sniff(self) -> None:
+        self.ctype = sniff_image_type(self._head)
+        if self.ctype not in ALLOWED_IMAGE_MIME:
+            raise ValueError(f"Unsupported image type: not PNG/JPEG/WebP (starts with {self._head[:8]!r})")
+
+    def store(self, meta: Optional[dict] = None) -> str:
+        """Hand the finished file to the asset store; returns the asset JSON."""
+        self._file.close()
+        if self.ctype is None:
+            self._sniff()
+        # Size and perceptual hash of the original travel with the asset (see select_images)
+        meta = meta or _image_meta(self.path, self.size)
+        digest = self._sha.hexdigest()
+        if NORMALIZE:
+            # Resized to the 6in display width, metadata stripped, smaller of PNG/JPEG; variant cached per DPI
+            asset = ASSET_STORE.put_file(
+                self.url, self.path, digest, "", transform=normalize_image, variant=f"dpi{TARGET_DPI}", meta=meta
+            )
+        elif self.ctype == "image/webp":
+            asset = ASSET_STORE.put_file(self.url, self.path, digest, "", transform=to_png, variant="png", meta=meta)
+        else:
+            # Content-addressed: same bytes -> same file and asset_id. Path is absolute (prevents CWD mismatch)
+            ext = ".jpg" if self.ctype == "image/jpeg" else ".png"
+            asset = ASSET_STORE.put_file(self.url, self.path, digest, ext, meta=meta)
+        return json.dumps(asset, ensure_ascii=False)
+
+
+def _store_image(url: str, content: bytes, meta: Optional[dict] = None) -> str:
+    with _Spool(url) as spool:
+        spool.feed(content)
+        return spool.store(meta)
+
+
+def _content_type(headers) -> str:
+    return (headers.get("Content-Type") or "").split(";")[0].strip().lower()
+
+
+def _fetch_image(url: str) -> str:
     """Download image URL to local disk for python-docx embedding."""
-    r = requests.get(url, timeout=30)
-    r.raise_for_status()
+    cached = ASSET_STORE.lookup(url)
+    if cached:
+        return json.dumps(cached, ensure_ascii=False)
+
+    with _session().get(url, timeout=IMAGE_TIMEOUT, stream=True) as r:
+        r.raise_for_status()
+        with _Spool(url, r.headers) as spool:
+            for chunk in r.iter_content(DOWNLOAD_CHUNK):
+                spool.feed(chunk)
+            return spool.store()
+
+
+async def _afetch_image(url: str) -> str:
+    cached = ASSET_STORE.lookup(url)
+    if cached:
+        return json.dumps(cached, ensure_ascii=False)
+
+    async with _ahttp().stream("GET", url) as r:
+        r.raise_for_status()
+        with _Spool(url, r.headers) as spool:
+            async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK):
+                spool.feed(chunk)
+            return await asyncio.to_thread(spool.store)  # hashing and normalizing are CPU work
+
+
+fetch_image = StructuredTool.from_function(
+    func=_fetch_image,
+    coroutine=_afetch_image,
+    name="fetch_image",
+    description="Download image URL (PNG/JPEG/WebP) to output/assets. Returns JSON {asset_id,path,source_url}.",
+)
+
+
+def _traced_fetch(url: str) -> str:
+    with span("tool.fetch_image", auto=True):
+        return fetch_image.invoke(url)
 
-    ctype = (r.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+
+def collect(urls: list[str], futures: list[Future], deadline_s: float = IMAGE_DEADLINE_S) -> list[Any]:
+    """Wait for one future per url under one shared deadline; the result or the error for each, in order."""
+    end = time.monotonic() + deadline_s
+    out: list[Any] = []
+    for url, fut in zip(urls, futures):
+        try:
+            out.append(fut.result(timeout=max(0.0, end - time.monotonic())))
+        except TimeoutError:
+            fut.cancel()
+            out.append(TimeoutError(f"no response from {url} within {deadline_s:.0f}s"))
+        except Exception as e:
+            out.append(e)
+    return out
+
+
+async def acollect(urls: list[str], aws: list, deadline_s: float = IMAGE_DEADLINE_S) -> list[Any]:
+    async def one(url: str, aw) -> Any:
+        try:
+            return await asyncio.wait_for(aw, timeout=deadline_s)
+        except TimeoutError:
+            return TimeoutError(f"no response from {url} within {deadline_s:.0f}s")
+        except Exception as e:
+            return e
+
+    return list(await asyncio.gather(*(one(u, aw) for u, aw in zip(urls, aws))))
+
+
+# ---------- candidate images: probe, rank, dedup ----------
+
+def _total_size(status: int, headers, got: int, ended: bool) -> Optional[int]:
+    if status == 206:
+        total = (headers.get("Content-Range") or "").rsplit("/", 1)[-1]  # "bytes 0-65535/123456"
+        return int(total) if total.isdigit() else None
+    length = headers.get("Content-Length") or ""
+    return int(length) if length.isdigit() else (got if ended else None)
+
+
+def _probe_result(url: str, status: int, headers, body: bytes, ended: bool) -> dict:
+    # The type comes from the magic bytes; a header that claims an image only labels the rejection
+    ctype = sniff_image_type(body)
+    total = _total_size(status, headers, len(body), ended)
+    probe = {"url": url, "ctype": ctype or f"unrecognized {_content_type(headers) or 'body'}", "bytes": total}
     if ctype not in ALLOWED_IMAGE_MIME:
-        raise ValueError(f"Unsupported image type: {ctype}")
-
-    content = r.content
-    if len(content) > MAX_BYTES:
-        raise ValueError("Image too large (>5MB)")
-
-    asset_id = f"img_{uuid.uuid4().hex[:8]}"
-
-    if ctype == "image/webp":
-        img = Image.open(BytesIO(content)).convert("RGB")
-        path = ASSETS_DIR / f"{asset_id}.png"
-        img.save(path, format="PNG")
-    else:
-        ext = ".jpg" if ctype == "image/jpeg" else ".png"
-        path = ASSETS_DIR / f"{asset_id}{ext}"
-        path.write_bytes(content)
-
-    # RETURN ABSOLUTE PATH (prevents CWD mismatch)
-    abs_path = str(path.resolve())
-    return json.dumps({"asset_id": asset_id, "path": abs_path, "source_url": url}, ensure_ascii=False)
+        return probe
+    if total is not None and len(body) >= total:
+        meta = _image_meta(body[:total])
+        if meta:
+            probe.update(meta, body=body[:total])
+    elif (size := image_size(body)) is not None:
+        probe["width"], probe["height"] = size
+    return probe
+
+
+def _cached_probe(url: str) -> Optional[dict]:
+    # Counted once per image actually used, by _download, not once per candidate looked at
+    cached = ASSET_STORE.lookup(url, count=False)
+    if not cached:
+        return None
+    return {"url": url, "asset": cached, **{k: cached[k] for k in ("width", "height", "dhash", "bytes") if k in cached}}
+
+
+def probe_image(url: str) -> dict:
+    """Header (and, for small files, the whole body) of a candidate image, from one capped Range request."""
+    cached = _cached_probe(url)
+    if cached:
+        return cached
+    with span("tool.probe_image", auto=True):
+        with _session().get(
+            url, headers={"Range": f"bytes=0-{PROBE_BYTES - 1}"}, timeout=IMAGE_TIMEOUT, stream=True
+        ) as r:
+            r.raise_for_status()
+            body, ended = b"", True
+            for chunk in r.iter_content(16384):
+                body += chunk
+                if len(body) >= PROBE_BYTES and r.status_code != 206:
+                    ended = False
+                    break
+            return _probe_result(url, r.status_code, r.headers, body, ended)
+
+
+async def aprobe_image(url: str) -> dict:
+    cached = _cached_probe(url)
+    if cached:
+        return cached
+    with span("tool.probe_image", auto=True):
+        async with _ahttp().stream("GET", url, headers={"Range": f"bytes=0-{PROBE_BYTES - 1}"}) as r:
+            r.raise_for_status()
+            body, ended = b"", True
+            async for chunk in r.aiter_bytes():
+                body += chunk
+                if len(body) >= PROBE_BYTES and r.status_code != 206:
+                    ended = False
+                    break
+            return _probe_result(url, r.status_code, r.headers, body, ended)
+
+
+def _rejected(probe: dict) -> Optional[str]:
+    if "asset" in probe:
+        return None
+    if probe["ctype"] not in ALLOWED_IMAGE_MIME:
+        return f"unsupported type {probe['ctype'] or '?'}"
+    if (probe.get("bytes") or 0) > MAX_BYTES:
+        return "too large"
+    if probe.get("width") is not None and probe["width"] < MIN_IMAGE_PX:
+        return f"too small ({probe['width']}px wide)"
+    return None
+
+
+class _Selection:
+    """Ranked candidates and the images chosen so far; shared by select_images and aselect_images."""
+
+    def __init__(self, urls: list[str], probes: list, limit: int, have: list[dict]):
+        self.limit = limit
+        self.have = have
+        self.chosen: list[dict] = []
+        self.fetched: list[tuple[str, dict | Exception]] = []
+        self.skipped: list[str] = []
+        ok = []
+        for url, p in zip(urls, probes):
+            reason = f"probe failed: {p}" if isinstance(p, Exception) else _rejected(p)
+            if reason:
+                self.skipped.append(f"{url}: {reason}")
+            else:
+                ok.append(p)
+        # Sharpest at the display width first; among equals the smaller file (fewer bytes to fetch and embed)
+        max_w = int(DISPLAY_WIDTH_IN * TARGET_DPI)
+        self.queue = sorted(ok, key=lambda p: (-min(p.get("width") or 0, max_w), p.get("bytes") or MAX_BYTES))
+
+    def _dup_of(self, item: dict, others: list[dict]) -> Optional[str]:
+        for a in others:
+            same_bytes = item.get("asset_id") is not None and item.get("asset_id") == a.get("asset_id")
+            if same_bytes or near_duplicate(item.get("dhash"), a.get("dhash")):
+                return a.get("asset_id") or a.get("url")
+        return None
+
+    def next_wave(self) -> list[dict]:
+        """Next candidates to download; the ones already known to repeat a chosen image are skipped unfetched."""
+        wave: list[dict] = []
+        while self.queue and len(self.chosen) + len(wave) < self.limit:
+            p = self.queue.pop(0)
+            dup = self._dup_of(p.get("asset") or p, self.have + self.chosen + wave)
+            if dup:
+                self.skipped.append(f"{p['url']}: near-duplicate of {dup}")
+            else:
+                wave.append(p)
+        return wave
+
+    def take(self, probe: dict, res: dict | Exception) -> None:
+        if isinstance(res, Exception):
+            self.fetched.append((probe["url"], res))
+            return
+        dup = self._dup_of(res, self.have + self.chosen)
+        if dup:
+            self.skipped.append(f"{probe['url']}: near-duplicate of {dup}")
+            return
+        self.chosen.append(res)
+        self.fetched.append((probe["url"], res))
+
+
+def _download(probe: dict) -> dict:
+    if "asset" in probe:
+        ASSET_STORE.count(hit=True)
+        return probe["asset"]
+    if "body" in probe:
+        ASSET_STORE.count(hit=False)
+        meta = {k: probe[k] for k in ("width", "height", "dhash", "bytes")}
+        return json.loads(_store_image(probe["url"], probe["body"], meta))
+    return json.loads(_traced_fetch(probe["url"]))
+
+
+async def _adownload(probe: dict) -> dict:
+    if "asset" in probe or "body" in probe:
+        return await asyncio.to_thread(_download, probe)  # normalizing is CPU work, keep it off the loop
+    with span("tool.fetch_image", auto=True):
+        return json.loads(await fetch_image.ainvoke(probe["url"]))
+
+
+def select_images(
+    urls: list[str], limit: int, have: Optional[list[dict]] = None, deadline_s: float = IMAGE_DEADLINE_S,
+    probes: Optional[list[Future]] = None,
+) -> tuple[list[tuple[str, dict | Exception]], list[str]]:
+    """Download the best `limit` distinct images among candidate urls.
+
+    Every candidate is probed (probe_image), ranked by resolution and size, and downloaded in
+    that order; one whose dHash is close to an image already chosen, or to one of `have`, is
+    skipped (before downloading when the probe already held the whole file). Returns the
+    (url, asset or error) pairs that were downloaded, and a note per skipped url. probes may
+    be futures already started for the urls (see prefetch.py).
+    """
+    end = time.monotonic() + deadline_s
+    futures = probes if probes is not None else [_fetch_pool.submit(bind(probe_image), u) for u in urls]
+    sel = _Selection(urls, collect(urls, futures, deadline_s), limit, list(have or []))
+    while wave := sel.next_wave():
+        downloads = [_fetch_pool.submit(bind(_download), p) for p in wave]
+        for p, res in zip(wave, collect([p["url"] for p in wave], downloads, max(0.0, end - time.monotonic()))):
+            sel.take(p, res)
+    return sel.fetched, sel.skipped
+
+
+async def aselect_images(
+    urls: list[str], limit: int, have: Optional[list[dict]] = None, deadline_s: float = IMAGE_DEADLINE_S,
+    probes: Optional[list[Future]] = None,
+) -> tuple[list[tuple[str, dict | Exception]], list[str]]:
+    end = time.monotonic() + deadline_s
+    aws = [asyncio.wrap_future(f) for f in probes] if probes is not None else [aprobe_image(u) for u in urls]
+    sel = _Selection(urls, await acollect(urls, aws, deadline_s), limit, list(have or []))
+    while wave := sel.next_wave():
+        results = await acollect([p["url"] for p in wave], [_adownload(p) for p in wave], max(0.0, end - time.monotonic()))
+        for p, res in zip(wave, results):
+            sel.take(p, res)
+    return sel.fetched, sel.skipped
 
 
 TOOLS = [web_search, fetch_image]